@@ -0,0 +1,98 @@
+# Profiles many CSV files at once.
+#
+#   > python batch.py <directory, glob pattern, or manifest file> [jobs=N] [summary=some.json] [lil_lex.py options]
+#
+# runs lil_lex.py on every CSV file in a directory (including .csv.gz,
+# .csv.bz2, and .csv.xz files), every CSV file matching a glob pattern (like
+# 'data/*/*.csv'), or every file listed in a manifest (a text file with one
+# path per line, relative to the manifest), in a pool of N processes (by
+# default, one per CPU). Any other options (like no_ints or
+# keys) are passed on to lil_lex.py. Each file's data dictionary is written
+# next to it as usual (unless analyze is given), and the results for all the
+# files go into one JSON summary (lil_lex-summary.json by default): each
+# field's type and example, and each file's empty fields, single-value
+# fields, and potential primary keys. Files that haven't changed (by content
+# hash) since they were last summarized with the same options are skipped.
+import os, io, re, sys, glob, json, hashlib, contextlib
+
+from concurrent.futures import ProcessPoolExecutor
+from lil_lex import profile_csv_file, parse_options
+from csv_input import is_csv_input, split_zip_member
+
+def csv_file_paths(source):
+    if os.path.isdir(source):
+        paths = [path for pattern in ['*.csv', '*.csv.gz', '*.csv.bz2', '*.csv.xz'] for path in glob.glob(os.path.join(source, pattern))]
+    elif not is_csv_input(source) and os.path.isfile(source):
+        directory = os.path.dirname(source)
+        with open(source) as f:
+            paths = [os.path.join(directory, line.strip()) for line in f if line.strip() != '' and not line.startswith('#')]
+        return paths
+    else:
+        paths = glob.glob(source)
+    # Skip the data dictionaries written by earlier runs.
+    return sorted(path for path in paths if re.search(r'-data-dictionary\.csv$', path) is None)
+
+def file_hash(path, block_size=1 << 20):
+    if split_zip_member(path) is not None: # For a zip member, hash the whole archive.
+        path = split_zip_member(path)[0]
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def summarize_file(csv_file_path, options, cached=None):
+    """Run lil_lex.py on one file (keeping its report off of stdout) and return
+    its summary, or the cached summary if the file and options haven't
+    changed and the data dictionary is still there."""
+    digest = file_hash(csv_file_path)
+    if cached is not None and cached['sha256'] == digest and cached['options'] == options:
+        if cached.get('data_dictionary_path') is None or os.path.exists(cached['data_dictionary_path']):
+            return dict(cached, cached=True)
+    report = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(report):
+            summary = profile_csv_file(csv_file_path, **options)
+        if summary is None:
+            summary = {'csv_file_path': csv_file_path, 'error': report.getvalue().strip()}
+    except Exception as e:
+        summary = {'csv_file_path': csv_file_path, 'error': f"{type(e).__name__}: {e}"}
+    summary.update({'sha256': digest, 'options': options, 'cached': False})
+    return summary
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: > python batch.py <directory, glob pattern, or manifest file> [jobs=N] [summary=some.json] [lil_lex.py options]")
+        return
+    jobs = os.cpu_count()
+    summary_path = 'lil_lex-summary.json'
+    for arg in sys.argv[2:]:
+        if re.match(r'jobs=\d+$', arg): # The number of files to profile at once
+            jobs = int(arg.split('=')[1])
+        if arg.startswith('summary='):
+            summary_path = arg.split('=', 1)[1]
+    options = parse_options(sys.argv[2:])
+
+    paths = csv_file_paths(sys.argv[1])
+    cache = {}
+    if os.path.exists(summary_path):
+        with open(summary_path) as f:
+            cache = {summary['csv_file_path']: summary for summary in json.load(f)['files'] if 'sha256' in summary}
+
+    # The worker processes are reused from file to file, so the imports are
+    # only paid for once per process.
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        summaries = list(executor.map(summarize_file, paths, [options]*len(paths), [cache.get(path) for path in paths]))
+    for summary in summaries:
+        if 'error' in summary:
+            status = f"FAILED ({summary['error'].splitlines()[-1] if summary['error'] else 'unknown error'})"
+        else:
+            status = 'unchanged' if summary['cached'] else f"{len(summary['fields'])} fields"
+        print(f"{summary['csv_file_path']}: {status}")
+
+    with open(summary_path, 'w') as f:
+        json.dump({'files': summaries}, f, indent=2)
+    print(f"Wrote the summary of {len(summaries)} files to {summary_path}.")
+
+if __name__ == '__main__':
+    main()
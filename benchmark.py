@@ -0,0 +1,313 @@
+# Benchmarks for lil_lex.py.
+#
+#   > python benchmark.py workers [number of rows] [maximum number of workers]
+#
+# generates a synthetic CSV file (by default, 10 million rows, which is a bit
+# over 1 GB) and times profiling it serially and with 1, 2, 4, ... worker
+# processes, reporting the speedup over the serial path and checking that
+# every parallel run gets the same result. It also reports how long finding
+# the split points takes, which is overhead that every parallel run pays.
+#
+#   > python benchmark.py suite [number of rows] [save] [tolerance=0.25]
+#
+# times the type-inference hot path (test_type, classify, choose_type,
+# date_or_datetime, snake_case, dump_to_format) and the whole of lil_lex.py
+# (on a synthetic file of 100,000 rows by default), reporting rows per second
+# and peak memory. Adding save stores the results in benchmark_baseline.json;
+# otherwise the results are compared with that baseline, and the run fails
+# (with exit status 1) if anything got more than 25% slower or bigger.
+#
+#   > python benchmark.py generate <some.csv> [rows=N] [columns=N] [nulls=0.1] [mix=int,sci_float,...] [no_bom] [no_id]
+#
+# just writes a synthetic file, with the columns cycling through the kinds
+# listed in mix (all of the kinds in column_kinds by default).
+#
+#   > python benchmark.py ckan [latency=0.05] [failure_rate=0] [fields=40]
+#
+# runs set_data_dictionary, compare_schemas, clone_data_dictionary, and
+# cached and uncached get_data_dictionary calls against a local fake CKAN
+# instance (fake_ckan.py) with the given latency per request, reporting the
+# round trips and time each one takes, and checks that the clone copied the
+# source's data dictionary (failing with exit status 1 if it didn't).
+import os, io, re, sys, csv, json, time, random, tempfile, tracemalloc, contextlib
+
+from lil_lex import (profile_rows, profile_csv_in_parallel, profile_csv_file, find_chunk_boundaries, available_cpus, test_type, classify, choose_type,
+        date_or_datetime, snake_case, dump_to_format, type_options, parse_datetime)
+
+def generate_csv(csv_file_path, rows, seed=0):
+    rng = random.Random(seed)
+    headers = ['_id', 'parcel_id', 'tax_year', 'ward', 'amount', 'filing_date', 'created_at', 'description', 'flag']
+    descriptions = ['Tax lien', 'Water lien', 'Sewage lien', 'Satisfaction, partial', 'NA', '']
+    with open(csv_file_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(headers)
+        for n in range(rows):
+            writer.writerow([n + 1,
+                f"{rng.randint(1, 999):04d}{rng.choice('ABCDEFGHJ')}{rng.randint(1, 400):05d}",
+                rng.randint(1990, 2022),
+                rng.randint(1, 32),
+                f"{rng.uniform(0, 50000):.2f}",
+                f"{rng.randint(1990, 2022)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+                f"{rng.randint(1990, 2022)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00",
+                rng.choice(descriptions),
+                rng.choice(['True', 'False', ''])])
+
+def summarize(profiles):
+    return [(p.field, p.type_candidates(), p.date_type(), p.value_example, p.none_count, p.is_unique()) for p in profiles]
+
+def benchmark_workers(rows, max_workers):
+    with tempfile.TemporaryDirectory() as directory:
+        csv_file_path = os.path.join(directory, 'synthetic.csv')
+        print(f"Generating {rows} rows...")
+        generate_csv(csv_file_path, rows)
+        print(f"{csv_file_path}: {os.path.getsize(csv_file_path)/1e9:.2f} GB\n")
+
+        with open(csv_file_path) as csvfile:
+            reader = csv.DictReader(csvfile)
+            fieldnames = reader.fieldnames
+            headers = [field for field in fieldnames if field != '_id']
+            start = time.perf_counter()
+            profiles, _ = profile_rows(headers, reader)
+            serial = time.perf_counter() - start
+        expected = summarize(profiles)
+        print(f"serial:     {serial:7.2f} s  {rows/serial:10.0f} rows/s")
+        start = time.perf_counter()
+        find_chunk_boundaries(csv_file_path, 2)
+        print(f"(finding the split points, which every parallel run does first: {time.perf_counter() - start:.2f} s)")
+        print(f"(CPUs available: {available_cpus()}; with just one, no parallel run can beat the serial one)")
+
+        workers = 1
+        while workers <= max_workers:
+            start = time.perf_counter()
+            profiles, _ = profile_csv_in_parallel(csv_file_path, fieldnames, headers, workers)
+            elapsed = time.perf_counter() - start
+            same = 'same result' if summarize(profiles) == expected else 'DIFFERENT RESULT'
+            print(f"workers={workers:<3} {elapsed:7.2f} s  {rows/elapsed:10.0f} rows/s  speedup {serial/elapsed:5.2f}  ({same})")
+            workers *= 2
+
+# Generators of values for each kind of synthetic column, chosen to hit the
+# tricky parts of type inference.
+column_kinds = {
+    'int': lambda rng: str(rng.randint(-5000, 100000)),
+    'leading_zero_id': lambda rng: f"{rng.randint(0, 99999):06d}",
+    'float': lambda rng: f"{rng.uniform(-1000, 1000):.{rng.randint(1, 4)}f}",
+    'sci_float': lambda rng: f"{rng.uniform(1, 9):.2f}e{rng.choice(['+', '-'])}{rng.randint(1, 12):02d}" if rng.random() < 0.01 else f"{rng.uniform(0, 1):.5f}",
+    'bool': lambda rng: rng.choice(['True', 'False', 'true', 'false']),
+    'date': lambda rng: f"{rng.randint(1990, 2022)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+    'datetime': lambda rng: f"{rng.randint(1990, 2022)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}",
+    'midnight_datetime': lambda rng: f"{rng.randint(1990, 2022)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 00:00:00",
+    'category': lambda rng: rng.choice(['Tax lien', 'Water lien', 'Sewage lien', 'Satisfaction, partial', 'Pothole']),
+    'text': lambda rng: ' '.join(rng.choice(['north', 'south', 'avenue', 'street', 'bridge', 'park', 'hill']) for _ in range(rng.randint(1, 4))) + f" {rng.randint(1, 9999)}",
+}
+
+def generate_mixed_csv(csv_file_path, rows, columns=12, null_rate=0.1, mix=None, bom=True, include_id=True, seed=0):
+    """Write a synthetic CSV file with the given number of columns, cycling
+    through the kinds in mix, with about null_rate of the values replaced by
+    '', 'NA', or 'NULL', a byte-order mark before the header (if bom), and
+    a leading _id column like CKAN's (if include_id)."""
+    rng = random.Random(seed)
+    mix = list(column_kinds) if mix is None else mix
+    kinds = [mix[k % len(mix)] for k in range(columns)]
+    headers = [f"{kind}_{k}" for k, kind in enumerate(kinds)]
+    if include_id:
+        headers = ['_id'] + headers
+    generators = [column_kinds[kind] for kind in kinds]
+    with open(csv_file_path, 'w', newline='', encoding='utf-8-sig' if bom else 'utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(headers)
+        for n in range(rows):
+            row = [rng.choice(['', 'NA', 'NULL']) if rng.random() < null_rate else generate(rng) for generate in generators]
+            writer.writerow([n + 1] + row if include_id else row)
+
+def best_time(f, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def run_suite(rows):
+    """Return a dict of timings (in seconds) and peak memory (in bytes)."""
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        csv_file_path = os.path.join(directory, 'synthetic.csv')
+        generate_mixed_csv(csv_file_path, rows)
+        with open(csv_file_path) as csvfile:
+            reader = csv.DictReader(csvfile)
+            headers = [field for field in reader.fieldnames if field != '_id']
+            rows_read = list(reader)
+        values = [row[field] for row in rows_read[:2000] for field in headers]
+        profiles, _ = profile_rows(headers, rows_read)
+        # All midnight, so that date_or_datetime has to parse every value
+        # (it stops at the first time of day that isn't midnight).
+        midnight_values = [row[field] for row in rows_read for field in headers if field.startswith('midnight_datetime')]
+
+        results['test_type'] = best_time(lambda: [test_type(value, option, []) for value in values for option in type_options])
+        def classify_cold():
+            classify.cache_clear()
+            parse_datetime.cache_clear()
+            for value in values:
+                classify(value)
+        results['classify'] = best_time(classify_cold)
+        results['choose_type'] = best_time(lambda: [choose_type(profile.type_candidates(), profile.field_values(),
+            profile.field, profile.date_type()) for profile in profiles for _ in range(100)])
+        def date_or_datetime_cold():
+            parse_datetime.cache_clear()
+            date_or_datetime(['date'], midnight_values)
+        results['date_or_datetime'] = best_time(date_or_datetime_cold)
+        results['snake_case'] = best_time(lambda: [snake_case(field) for field in headers for _ in range(1000)])
+        results['dump_to_format'] = best_time(lambda: [dump_to_format(field) for field in headers for _ in range(1000)])
+
+        def whole_run():
+            classify.cache_clear()
+            parse_datetime.cache_clear()
+            with contextlib.redirect_stdout(io.StringIO()):
+                profile_csv_file(csv_file_path)
+        results['main'] = best_time(whole_run, repeat=3)
+        results['main_rows_per_second'] = rows/results['main']
+        tracemalloc.start()
+        whole_run()
+        results['main_peak_memory'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return results
+
+def compare_with_baseline(results, baseline, tolerance):
+    """Return descriptions of the results that are worse than the baseline
+    by more than the tolerance (as a fraction)."""
+    regressions = []
+    for name, value in results.items():
+        if name not in baseline:
+            continue
+        if name.endswith('_per_second'):
+            if value < baseline[name]*(1 - tolerance):
+                regressions.append(f"{name}: {value:.0f} (baseline {baseline[name]:.0f})")
+        elif value > baseline[name]*(1 + tolerance):
+            regressions.append(f"{name}: {value:.4g} (baseline {baseline[name]:.4g})")
+    return regressions
+
+def benchmark_suite(rows, save, tolerance, baseline_path='benchmark_baseline.json'):
+    results = run_suite(rows)
+    baseline = None
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+    for name, value in results.items():
+        if name == 'main_rows_per_second':
+            line = f"{name:<22} {value:12.0f} rows/s"
+        elif name == 'main_peak_memory':
+            line = f"{name:<22} {value/1e6:12.1f} MB"
+        else:
+            line = f"{name:<22} {value:12.4f} s"
+        if baseline is not None and baseline.get('rows') == rows and name in baseline['results']:
+            line += f"   (baseline: {baseline['results'][name]:.4g})"
+        print(line)
+    if save:
+        with open(baseline_path, 'w') as f:
+            json.dump({'rows': rows, 'results': results}, f, indent=2)
+        print(f"\nSaved these results to {baseline_path}.")
+        return True
+    if baseline is None:
+        print(f"\nThere's no {baseline_path} to compare with yet (add save to make one).")
+        return True
+    if baseline.get('rows') != rows:
+        print(f"\nThe baseline in {baseline_path} is for {baseline.get('rows')} rows, so it can't be compared.")
+        return True
+    regressions = compare_with_baseline(results, baseline['results'], tolerance)
+    if len(regressions) > 0:
+        print(f"\nREGRESSIONS (more than {tolerance:.0%} worse than the baseline):")
+        for regression in regressions:
+            print(f"   {regression}")
+        return False
+    print(f"\nNothing is more than {tolerance:.0%} worse than the baseline.")
+    return True
+
+def benchmark_ckan(latency=0.05, failure_rate=0.0, field_count=40):
+    # These need ckanapi, which nothing else here does.
+    import data_dictionary_util
+    from ckan_cache import MetadataCache
+    from fake_ckan import FakeCKAN, sample_fields
+
+    fake = FakeCKAN(latency, failure_rate)
+    source_fields = sample_fields(field_count)
+    fake.add_resource('source', source_fields)
+    fake.add_resource('destination', [{'id': f['id'], 'type': f['type']} for f in source_fields])
+    site, API_key = fake.start(), 'fake-key'
+    original_cache = data_dictionary_util.metadata_cache
+    all_correct = True
+    with tempfile.TemporaryDirectory() as directory:
+        # Each operation starts with an empty cache, except for the ones
+        # marked as reusing the previous one's.
+        operations = [
+            ('get_data_dictionary', False, lambda: data_dictionary_util.get_data_dictionary(site, 'source', API_key)),
+            ('get_data_dictionary (cached)', True, lambda: data_dictionary_util.get_data_dictionary(site, 'source', API_key)),
+            ('compare_schemas', False, lambda: data_dictionary_util.compare_schemas(site, 'source', 'destination', API_key)),
+            ('compare_schemas (cached)', True, lambda: data_dictionary_util.compare_schemas(site, 'source', 'destination', API_key)),
+            ('set_data_dictionary', False, lambda: data_dictionary_util.set_data_dictionary(site, 'destination', source_fields[:field_count//2], API_key)),
+            ('clone_data_dictionary', False, lambda: data_dictionary_util.clone_data_dictionary(site, 'source', 'destination', API_key)),
+            ]
+        print(f"{'operation':<34} {'round trips':>11} {'seconds':>9}")
+        for k, (name, reuses_cache, operation) in enumerate(operations):
+            if not reuses_cache:
+                data_dictionary_util.metadata_cache = MetadataCache(os.path.join(directory, str(k)))
+            fake.calls.clear()
+            start = time.perf_counter()
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    operation()
+                outcome = ''
+            except Exception as e:
+                outcome = f"   FAILED ({type(e).__name__})"
+            elapsed = time.perf_counter() - start
+            print(f"{name:<34} {fake.round_trips():>11} {elapsed:>9.3f}{outcome}")
+        data_dictionary_util.metadata_cache = original_cache
+    fake.stop()
+
+    copied = {f['id']: f.get('info') for f in fake.resources['destination']['fields'][1:]}
+    if copied != {f['id']: f['info'] for f in source_fields}:
+        print("\nThe destination's data dictionary doesn't match the source's after the clone.")
+        all_correct = False
+    return all_correct
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in ['workers', 'suite', 'generate', 'ckan']:
+        print("Usage: > python benchmark.py workers [number of rows] [maximum number of workers]")
+        print("       > python benchmark.py suite [number of rows] [save] [tolerance=0.25]")
+        print("       > python benchmark.py generate <some.csv> [rows=N] [columns=N] [nulls=0.1] [mix=int,sci_float,...] [no_bom] [no_id]")
+        print("       > python benchmark.py ckan [latency=0.05] [failure_rate=0] [fields=40]")
+    elif sys.argv[1] == 'workers':
+        rows = int(sys.argv[2]) if len(sys.argv) > 2 else 10000000
+        max_workers = int(sys.argv[3]) if len(sys.argv) > 3 else os.cpu_count()
+        benchmark_workers(rows, max_workers)
+    elif sys.argv[1] == 'suite':
+        rows = int(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[2].isdigit() else 100000
+        tolerance = 0.25
+        for arg in sys.argv[2:]:
+            if re.match(r'tolerance=[0-9.]+$', arg):
+                tolerance = float(arg.split('=')[1])
+        if not benchmark_suite(rows, 'save' in sys.argv[2:], tolerance):
+            sys.exit(1)
+    elif sys.argv[1] == 'ckan':
+        options = {'latency': 0.05, 'failure_rate': 0.0, 'field_count': 40}
+        for arg in sys.argv[2:]:
+            if re.match(r'latency=[0-9.]+$', arg):
+                options['latency'] = float(arg.split('=')[1])
+            if re.match(r'failure_rate=[0-9.]+$', arg):
+                options['failure_rate'] = float(arg.split('=')[1])
+            if re.match(r'fields=\d+$', arg):
+                options['field_count'] = int(arg.split('=')[1])
+        if not benchmark_ckan(**options):
+            sys.exit(1)
+    else:
+        options = {'rows': 100000, 'columns': 12, 'null_rate': 0.1, 'mix': None}
+        for arg in sys.argv[3:]:
+            if re.match(r'rows=\d+$', arg):
+                options['rows'] = int(arg.split('=')[1])
+            if re.match(r'columns=\d+$', arg):
+                options['columns'] = int(arg.split('=')[1])
+            if re.match(r'nulls=[0-9.]+$', arg):
+                options['null_rate'] = float(arg.split('=')[1])
+            if arg.startswith('mix='):
+                options['mix'] = arg.split('=')[1].split(',')
+        generate_mixed_csv(sys.argv[2], bom='no_bom' not in sys.argv[3:], include_id='no_id' not in sys.argv[3:], **options)
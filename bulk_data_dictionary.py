@@ -0,0 +1,201 @@
+# Downloads or uploads the integrated data dictionaries of many CKAN
+# resources at once.
+#
+#   > python bulk_data_dictionary.py download <resource IDs, or a file listing them> [package=ID] [organization=ID] [options]
+#   > python bulk_data_dictionary.py upload <directory or combined data-dictionary CSV file> [options]
+#
+# download fetches the data dictionary of every datastore resource in the
+# given packages and organizations (and of any resource IDs listed on the
+# command line or in a text file, one per line) and writes each one to
+# <resource ID>-data-dictionary.csv (in the directory given by directory=,
+# the current directory by default) or, with combined=some.csv, all of them
+# to one CSV file with a resource_id column.
+#
+# upload takes either a directory of <resource ID>-data-dictionary.csv files
+# or a combined file (with a resource_id column) and uploads each resource's
+# data dictionary, as upload_data_dictionary.py does.
+#
+# The resources are handled jobs=N (8 by default) at a time, no more than
+# rate=R of them (5 by default) are started per second, and a resource whose
+# request fails in a way that might be temporary (a connection error or a
+# response that isn't a CKAN API response) is retried (retries=3 times by
+# default), backing off exponentially. Each resource's result is printed as
+# it finishes. The refresh and no_cache options are as for
+# download_data_dictionary.py.
+import os, re, sys, csv, glob, time, random, threading, requests, ckanapi
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from credentials import site, API_key # Use sample-credentials.py as a model for creating this file.
+from data_dictionary_util import get_client, get_data_dictionary, set_data_dictionary, get_package_metadata, apply_cache_options
+from download_data_dictionary import convert_fields_to_list_of_dicts, write_to_csv
+from upload_data_dictionary import synthesize_data_dictionary
+
+dictionary_keys = ['column', 'type', 'label', 'description']
+
+class RateLimiter:
+    """Spaces out the starts of operations (across all threads) so that no
+    more than rate of them start per second."""
+    def __init__(self, rate):
+        self.interval = 1.0/rate if rate > 0 else 0.0
+        self.next_start = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+def is_transient(e):
+    # NotFound, NotAuthorized, and ValidationError (all subclasses of
+    # CKANAPIError) won't go away by trying again, but a bare CKANAPIError
+    # or ServerIncompatibleError usually means a proxy returned an error page.
+    return isinstance(e, requests.exceptions.RequestException) or type(e) in [ckanapi.errors.CKANAPIError, ckanapi.errors.ServerIncompatibleError]
+
+def with_retries(f, limiter, retries=3, backoff=1.0):
+    """Call f (waiting for the limiter before each attempt), retrying it after
+    transient errors with exponentially increasing (jittered) delays."""
+    for attempt in range(retries + 1):
+        limiter.wait()
+        try:
+            return f()
+        except Exception as e:
+            if attempt == retries or not is_transient(e):
+                raise
+            time.sleep(backoff*2**attempt*random.uniform(0.5, 1.5))
+
+def datastore_resource_ids(resources):
+    return [r['id'] for r in resources if r.get('datastore_active')]
+
+def organization_resource_ids(site, organization, API_key=None, rows=1000):
+    ckan = get_client(site, API_key)
+    resource_ids = []
+    start = 0
+    while True:
+        results = ckan.action.package_search(fq=f'organization:{organization}', rows=rows, start=start, include_private=API_key is not None)
+        for package in results['results']:
+            resource_ids += datastore_resource_ids(package['resources'])
+        start += rows
+        if start >= results['count'] or len(results['results']) == 0:
+            return resource_ids
+
+def resolve_resource_ids(site, args, API_key=None):
+    """Turn the command-line targets (resource IDs, files listing them,
+    package=ID, and organization=ID) into a list of resource IDs, in order
+    and without duplicates."""
+    resource_ids = []
+    for arg in args:
+        if arg.startswith('package='):
+            resource_ids += datastore_resource_ids(get_package_metadata(site, arg.split('=', 1)[1], API_key)['resources'])
+        elif arg.startswith('organization='):
+            resource_ids += organization_resource_ids(site, arg.split('=', 1)[1], API_key)
+        elif os.path.isfile(arg):
+            with open(arg) as f:
+                resource_ids += [line.strip() for line in f if line.strip() != '' and not line.startswith('#')]
+        else:
+            resource_ids.append(arg)
+    return list(dict.fromkeys(resource_ids))
+
+def download_one(resource_id, directory, limiter, retries):
+    fields = with_retries(lambda: get_data_dictionary(site, resource_id, API_key), limiter, retries)
+    if fields is None:
+        raise ValueError("not found (or not in the datastore)")
+    rows = convert_fields_to_list_of_dicts(fields)
+    if directory is None: # The rows go into the combined file.
+        return rows, f"{len(rows)} fields"
+    save_filename = os.path.join(directory, f'{resource_id}-data-dictionary.csv')
+    write_to_csv(save_filename, rows, dictionary_keys)
+    return rows, f"{len(rows)} fields -> {save_filename}"
+
+def upload_one(resource_id, fields, limiter, retries):
+    results = with_retries(lambda: set_data_dictionary(site, resource_id, fields, API_key), limiter, retries)
+    return results, f"{len(results.get('fields', []))} fields set"
+
+def dictionaries_to_upload(source):
+    """Return a dict mapping each resource ID to the rows of its data
+    dictionary, from a directory of data-dictionary files or a combined
+    file."""
+    dictionaries = {}
+    if os.path.isdir(source):
+        for path in sorted(glob.glob(os.path.join(source, '*-data-dictionary.csv'))):
+            resource_id = re.sub(r'-data-dictionary\.csv$', '', os.path.basename(path))
+            with open(path, 'r') as f:
+                dictionaries[resource_id] = list(csv.DictReader(f))
+    else:
+        with open(source, 'r') as f:
+            for row in csv.DictReader(f):
+                dictionaries.setdefault(row['resource_id'], []).append(row)
+    return dictionaries
+
+def run(tasks, jobs):
+    """Run the tasks (a dict mapping each resource ID to a function of no
+    arguments) in a pool of jobs threads, printing each resource's result as
+    it finishes. Return the results (resource ID -> (value, None) or (None,
+    error message)) in the order of the tasks."""
+    results = {}
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(task): resource_id for resource_id, task in tasks.items()}
+        for future in as_completed(futures):
+            resource_id = futures[future]
+            try:
+                value, description = future.result()
+                results[resource_id] = (value, None)
+                print(f"{resource_id}: {description}")
+            except Exception as e:
+                results[resource_id] = (None, f"{type(e).__name__}: {e}")
+                print(f"{resource_id}: FAILED ({results[resource_id][1]})")
+    return {resource_id: results[resource_id] for resource_id in tasks}
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] not in ['download', 'upload']:
+        print("Usage:\n   > python bulk_data_dictionary.py download <resource IDs or ID file> [package=ID] [organization=ID] [directory=dir | combined=file.csv] [jobs=N] [rate=R] [retries=N] [refresh] [no_cache]\n"
+            "   > python bulk_data_dictionary.py upload <directory or combined CSV file> [jobs=N] [rate=R] [retries=N]")
+        return
+    mode = sys.argv[1]
+    jobs, rate, retries = 8, 5.0, 3
+    directory, combined_path = '.', None
+    targets = []
+    for arg in apply_cache_options(sys.argv[2:]):
+        if re.match(r'jobs=\d+$', arg):
+            jobs = int(arg.split('=')[1])
+        elif re.match(r'rate=[\d.]+$', arg): # Resources started per second (0 for no limit)
+            rate = float(arg.split('=')[1])
+        elif re.match(r'retries=\d+$', arg):
+            retries = int(arg.split('=')[1])
+        elif arg.startswith('directory='):
+            directory = arg.split('=', 1)[1]
+        elif arg.startswith('combined='):
+            combined_path = arg.split('=', 1)[1]
+        else:
+            targets.append(arg)
+
+    limiter = RateLimiter(rate)
+    get_client(site, API_key, pool_size=max(jobs, 16)) # Create the shared client before the threads need it.
+    if mode == 'download':
+        resource_ids = resolve_resource_ids(site, targets, API_key)
+        if combined_path is None:
+            os.makedirs(directory, exist_ok=True)
+        output_directory = directory if combined_path is None else None
+        tasks = {resource_id: (lambda resource_id=resource_id: download_one(resource_id, output_directory, limiter, retries)) for resource_id in resource_ids}
+    else:
+        dictionaries = {}
+        for target in targets:
+            dictionaries.update(dictionaries_to_upload(target))
+        tasks = {resource_id: (lambda resource_id=resource_id, rows=rows: upload_one(resource_id, synthesize_data_dictionary(rows), limiter, retries))
+                for resource_id, rows in dictionaries.items()}
+
+    results = run(tasks, jobs)
+    failures = [resource_id for resource_id, (_, error) in results.items() if error is not None]
+
+    if mode == 'download' and combined_path is not None:
+        combined_rows = [dict(row, resource_id=resource_id) for resource_id, (rows, error) in results.items() if error is None for row in rows]
+        write_to_csv(combined_path, combined_rows, ['resource_id'] + dictionary_keys)
+        print(f"Wrote the data dictionaries of {len(results) - len(failures)} resources to {combined_path}.")
+    print(f"{len(results) - len(failures)} of {len(results)} resources succeeded.")
+    if failures:
+        print(f"Failed: {failures}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
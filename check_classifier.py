@@ -0,0 +1,87 @@
+# A differential test of lil_lex.classify against lil_lex.test_type. Every
+# value from the given CSV files (or the files in examples/ if none are given)
+# plus a generated corpus of tricky values is run through both, and any
+# disagreement is reported. If pyarrow is installed, the vectorized version
+# used by backend=arrow (arrow_compatible_types) is checked too.
+import sys, csv, glob, random
+
+from lil_lex import test_type, classify, type_options, type_bits, is_scientific_notation, arrow_compatible_types, pyarrow
+
+def expected_mask(value):
+    mask = 0
+    for option in type_options:
+        if test_type(value, option, []):
+            mask |= type_bits[option]
+    return mask
+
+def expected_warning(value):
+    warnings = []
+    test_type(value, 'float', warnings)
+    return len(warnings) > 0
+
+def values_from_csv(csv_file_path):
+    with open(csv_file_path) as csvfile:
+        for row in csv.reader(csvfile):
+            yield from row
+
+def generated_corpus(n=20000, seed=0):
+    rng = random.Random(seed)
+    # Hand-picked edge cases: leading zeros, scientific notation, ISO dates
+    # and datetimes (some invalid, some at midnight, some with time zones),
+    # non-ASCII digits, and stray whitespace.
+    yield from ['', 'NA', 'N/A', 'NULL', 'null', 'None', '0', '00', '007', '-0', '-07', '0.5', '.5', '5.', '-.5',
+        '-5.', '0012.5', '1e5', '3e+05', '2e-04', '1.5E10', '-1.5e-3', '12e', 'e12', '1.2.3', '--1', '+1',
+        'True', 'true', 'TRUE', 'False', 'false', '1', 'yes', '2021-05-12', '2021-5-12', '2021-02-30',
+        '0999-01-01', '2021-05-12T21:52:00', '2021-05-12 21:52:00', '2021-05-12T00:00:00', '2021-05-12 21:52',
+        '2021-05-12T21:52:00.123456', '2021-05-12T21:52:00.123', '2021-05-12T21:52:00+00:00',
+        '2021-05-12T21:52:00Z', '2021-05-12T21:52:00-05:00', '2021-05-12T21:52:00+05:30:15', '20210512',
+        '05/12/2021', 'May 12, 2021', '2021-05-12 ', ' 2021-05-12', '2021-05-12\n', '12\n', '0\n', ' 12',
+        '١٢٣', '٠١٢', '12:30', 'T', '2021-05-12T24:00:00', '2021-13-01']
+    templates = [
+        lambda: str(rng.randint(-10**6, 10**6)),
+        lambda: f"{rng.randint(0, 99999):05d}",
+        lambda: f"{rng.uniform(-1000, 1000):.{rng.randint(0, 6)}f}",
+        lambda: f"{rng.uniform(-1000, 1000):.{rng.randint(1, 4)}e}",
+        lambda: f"{rng.randint(1, 9)}{rng.choice('eE')}{rng.choice(['+', '-', ''])}{rng.randint(0, 20):02d}",
+        lambda: f"{rng.randint(0, 2100):04d}-{rng.randint(0, 13):02d}-{rng.randint(0, 32):02d}",
+        lambda: f"{rng.randint(1900, 2100)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}{rng.choice('T ')}{rng.randint(0, 24):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 60):02d}" + rng.choice(['', '.000000', f".{rng.randint(0, 999999):06d}", '+00:00', '-04:00', 'Z']),
+        lambda: f"{rng.randint(1900, 2100)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 00:00:00",
+        lambda: ''.join(rng.choice('0123456789-.:eET +') for _ in range(rng.randint(1, 12))),
+    ]
+    for _ in range(n):
+        yield rng.choice(templates)()
+
+def check(values):
+    checked, mismatches = 0, []
+    values = list(values)
+    for value in values:
+        checked += 1
+        if classify(value) != expected_mask(value):
+            mismatches.append(value)
+        elif not classify(value) & type_bits['float'] and is_scientific_notation(value) != expected_warning(value):
+            mismatches.append(value)
+    if pyarrow is not None:
+        distinct_values = list(dict.fromkeys(values))
+        for value, compatible in zip(distinct_values, arrow_compatible_types(pyarrow.array(distinct_values))):
+            if compatible != classify(value) and value not in mismatches:
+                mismatches.append(value)
+    return checked, mismatches
+
+def main():
+    csv_file_paths = sys.argv[1:] if len(sys.argv) > 1 else sorted(glob.glob('examples/*.csv'))
+    sources = [(path, values_from_csv(path)) for path in csv_file_paths]
+    sources.append(('generated corpus', generated_corpus()))
+    failed = False
+    for name, values in sources:
+        checked, mismatches = check(values)
+        print(f"{name}: {checked} values checked, {len(mismatches)} mismatches")
+        for value in mismatches[:20]:
+            compatible = [option for option in type_options if classify(value) & type_bits[option]]
+            expected = [option for option in type_options if expected_mask(value) & type_bits[option]]
+            print(f"   {value!r}: classify says {compatible}, but test_type says {expected}")
+        failed = failed or len(mismatches) > 0
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+# An on-disk cache of CKAN metadata (resource fields, resource metadata, and
+# package metadata), so that repeated downloads, comparisons, and clones in
+# a work session don't have to ask the CKAN instance for the same things
+# over and over.
+import os, json, time, hashlib, threading
+
+default_cache_directory = os.path.join(os.path.expanduser('~'), '.cache', 'little-lexicographer')
+
+class MetadataCache:
+    """Stores each entry (a kind of metadata for one site and ID) as a JSON
+    file in directory. Entries younger than max_age seconds are trusted as
+    they are; older ones have to be revalidated (or fetched again) by the
+    caller. With refresh, nothing is read from the cache, but everything
+    fetched is still written to it; with enabled False, the cache isn't
+    used at all."""
+    def __init__(self, directory=default_cache_directory, max_age=600, refresh=False, enabled=True):
+        self.directory = directory
+        self.max_age = max_age
+        self.refresh = refresh
+        self.enabled = enabled
+
+    def path(self, kind, site, id):
+        key = hashlib.sha256(f"{site}|{kind}|{id}".encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f"{kind}-{key}.json")
+
+    def load(self, kind, site, id):
+        """Return the entry (a dict with the cached value, the version it was
+        saved with, and when it was fetched), or None."""
+        if not self.enabled or self.refresh:
+            return None
+        try:
+            with open(self.path(kind, site, id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_fresh(self, entry):
+        return time.time() - entry['fetched_at'] < self.max_age
+
+    def save(self, kind, site, id, value, version=None):
+        if not self.enabled:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(kind, site, id)
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp" # So that a reader never sees half an entry
+        with open(temporary_path, 'w') as f:
+            json.dump({'value': value, 'version': version, 'fetched_at': time.time()}, f)
+        os.replace(temporary_path, path)
+
+    def invalidate(self, kind, site, id):
+        try:
+            os.remove(self.path(kind, site, id))
+        except OSError:
+            pass
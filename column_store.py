@@ -0,0 +1,40 @@
+# A compact in-memory copy of a table's columns, for analyses that need to
+# look at every row more than once (like the search for composite keys).
+from array import array
+from collections import Counter
+
+class ColumnStore:
+    """Holds each column as an array of small integer codes plus a dictionary
+    that maps each distinct value to its code (the order in which the values
+    first appear), so that a repeated value is stored once per column rather
+    than once per row, and each cell takes four bytes."""
+    def __init__(self, columns):
+        self.columns = list(dict.fromkeys(columns)) # Deduplicated
+        self.codes = {column: array('i') for column in self.columns}
+        self.dictionaries = {column: {} for column in self.columns}
+        self.row_count = 0
+
+    def add_rows(self, rows):
+        """Append rows (dicts like those yielded by csv.DictReader)."""
+        columns = [(self.codes[column], self.dictionaries[column], column) for column in self.columns]
+        for row in rows:
+            for codes, dictionary, column in columns:
+                value = row[column]
+                code = dictionary.get(value)
+                if code is None:
+                    code = dictionary[value] = len(dictionary)
+                codes.append(code)
+            self.row_count += 1
+        return self
+
+    def values(self, column):
+        """The distinct values of the column, in the order of their codes."""
+        return list(self.dictionaries[column])
+
+    def counts(self, column):
+        """The number of rows with each distinct value, in the order of their codes."""
+        counter = Counter(self.codes[column])
+        return [counter[code] for code in range(len(self.dictionaries[column]))]
+
+    def cardinalities(self):
+        return {column: len(self.dictionaries[column]) for column in self.columns}
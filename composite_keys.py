@@ -0,0 +1,102 @@
+# Discovery of minimal combinations of fields that uniquely identify rows
+# (composite primary keys), like (parcel_id, tax_year).
+from functools import reduce
+from operator import add, mul
+from itertools import combinations, islice, repeat
+
+def combined_codes(codes, cardinalities, combination):
+    # A row's codes for the columns in the combination, packed into a single
+    # integer (which is distinct for every distinct tuple of values), so
+    # that no tuples need to be built or stored. This is built entirely
+    # out of map and operator functions so that it runs at C speed.
+    first, rest = combination[0], combination[1:]
+    return reduce(lambda keys, column: map(add, map(mul, keys, repeat(cardinalities[column])), codes[column]),
+        rest, iter(codes[first]))
+
+def find_duplicates(codes, cardinalities, combination, limit=32):
+    """Look for pairs of rows that agree on every column in the combination.
+    Returns a list of up to limit (i, j) pairs of row indices (empty if the
+    combination is a key)."""
+    # Check ever-longer prefixes of the rows, so that a combination that
+    # isn't a key is usually ruled out after looking at only a few rows.
+    row_count = len(codes[combination[0]])
+    prefix = 1024
+    while True:
+        prefix = min(prefix, row_count)
+        distinct_keys = set(islice(combined_codes(codes, cardinalities, combination), prefix))
+        if len(distinct_keys) < prefix:
+            break
+        if prefix == row_count:
+            return []
+        prefix *= 4
+    # There's a duplicate in the prefix, so go through it again to find some.
+    keys = list(islice(combined_codes(codes, cardinalities, combination), prefix))
+    last_row = dict(zip(keys, range(prefix)))
+    first_row = dict(zip(reversed(keys), range(prefix - 1, -1, -1)))
+    duplicates = [(first_row[key], j) for key, j in last_row.items() if first_row[key] != j]
+    return duplicates[:limit]
+
+def find_composite_keys(codes, cardinalities, row_count, max_size=3, max_keys=25):
+    """Find the minimal combinations of (two to max_size) columns whose
+    values are unique in every row, level by level, stopping once max_keys
+    have been found. codes holds the code array of each column to consider
+    (as in a ColumnStore), and these should already exclude empty,
+    single-value, and (by themselves) unique fields.
+
+    A combination is skipped if it contains a key found at a lower level
+    (so only minimal keys are reported). It is ruled out without a scan if
+    the product of its columns' cardinalities is less than the number of
+    rows or if a pair of rows that agree on one of its subsets also agree
+    on the rest of its columns. Scans stop at the first few duplicate rows.
+    Returns the keys as tuples, ordered by size."""
+    columns = sorted(codes, key=lambda column: -cardinalities[column])
+    witnesses = {} # Pairs of rows that agree on each non-key combination
+    for column in columns:
+        witnesses[(column,)] = find_duplicates(codes, cardinalities, (column,))
+    keys = []
+    level = [(column,) for column in columns]
+    for size in range(2, max_size + 1):
+        next_level = []
+        non_keys = set(level)
+        for combination in candidate_combinations(level, columns):
+            if any(subset not in non_keys for subset in combinations(combination, size - 1)):
+                continue # Some subset is a key (or was skipped), so this can't be a minimal key.
+            if reduce(lambda product, column: product*cardinalities[column], combination, 1) < row_count:
+                # There are too few combinations of values to go around.
+                next_level.append(combination)
+                continue
+            duplicates = inherited_duplicates(codes, combination, witnesses)
+            if len(duplicates) == 0:
+                duplicates = find_duplicates(codes, cardinalities, combination)
+            if len(duplicates) == 0:
+                keys.append(combination)
+                if len(keys) == max_keys:
+                    return keys
+            else:
+                witnesses[combination] = duplicates
+                next_level.append(combination)
+        level = next_level
+    return keys
+
+def candidate_combinations(level, columns):
+    # Join combinations that differ only in their last column (Apriori style),
+    # keeping the columns of each combination in the order of columns.
+    position = {column: k for k, column in enumerate(columns)}
+    by_prefix = {}
+    for combination in level:
+        by_prefix.setdefault(combination[:-1], []).append(combination[-1])
+    for prefix, lasts in by_prefix.items():
+        lasts = sorted(lasts, key=position.get)
+        for a, b in combinations(lasts, 2):
+            yield prefix + (a, b)
+
+def inherited_duplicates(codes, combination, witnesses):
+    # Rows that agree on a subset of the combination and also on its other
+    # columns show that the combination isn't a key either.
+    for k in range(len(combination)):
+        subset = combination[:k] + combination[k+1:]
+        column = combination[k]
+        for i, j in witnesses.get(subset, []):
+            if codes[column][i] == codes[column][j]:
+                return [(i, j)]
+    return []
@@ -1,7 +1,7 @@
-import sys, time, ckanapi
+import sys, time
 from credentials import site, API_key # Use sample-credentials.py as a model for creating this file.
 from pprint import pprint
-from data_dictionary_util import clone_data_dictionary
+from data_dictionary_util import clone_data_dictionary, get_resource_metadata, get_package_metadata, apply_cache_options
 
 def get_resource_parameter(site, resource_id, parameter=None, API_key=None):
     # Some resource parameters you can fetch with this function are
@@ -13,8 +13,7 @@ def get_resource_parameter(site, resource_id, parameter=None, API_key=None):
     # 'revision_id', 'resource_type'
     # Note that 'size' does not seem to be defined for tabular
     # data on WPRDC.org. (It's not the number of rows in the resource.)
-    ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
-    metadata = ckan.action.resource_show(id=resource_id)
+    metadata = get_resource_metadata(site, resource_id, API_key)
     if parameter is None:
         return metadata
     else:
@@ -36,8 +35,7 @@ def get_package_parameter(site, package_id, parameter=None, API_key=None):
     # 'name', 'isopen', 'url', 'notes', 'license_title',
     # 'temporal_coverage', 'related_documents', 'license_url',
     # 'organization', 'revision_id'
-    ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
-    metadata = ckan.action.package_show(id=package_id)
+    metadata = get_package_metadata(site, package_id, API_key)
     if parameter is None:
         return metadata
     else:
@@ -54,9 +52,10 @@ def get_package_name_from_resource_id(site, resource_id, API_key=None):
     return get_package_parameter(site, p_id, 'title', API_key)
 
 if __name__ == '__main__':
-    if len(sys.argv) < 3:
+    args = apply_cache_options(sys.argv[1:])
+    if len(args) < 2:
         print("Please specify two resource IDs, one for the source of the data dictionary and one for the destination.")
-    source_resource_id, destination_resource_id = sys.argv[1], sys.argv[2]
+    source_resource_id, destination_resource_id = args[0], args[1]
 
     if source_resource_id == destination_resource_id:
         raise ValueError(f'It makes no sense to copy a data dictionary from one resource to itself! ({source_resource_id} == {destination_resource_id})')
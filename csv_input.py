@@ -0,0 +1,83 @@
+# Opening CSV input that isn't a plain .csv file: gzip, bzip2, or xz
+# compressed files (like data.csv.gz), members of zip archives (like
+# archive.zip:data.csv, or just archive.zip if it holds only one CSV file),
+# and stdin (-, compressed or not). Everything is decompressed as it's read,
+# so nothing is written to disk.
+import io, os, re, sys, bz2, gzip, lzma, zipfile
+
+openers = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+magic_numbers = {b'\x1f\x8b': lambda f: gzip.GzipFile(fileobj=f), b'BZh': bz2.BZ2File, b'\xfd7zXZ\x00': lzma.LZMAFile} # For stdin
+
+def split_zip_member(path):
+    """Return the archive path and member name of 'archive.zip:member.csv'
+    (or 'archive.zip', with None for the member), or None if path isn't in
+    a zip file."""
+    match = re.match(r'(.*\.zip)(?::(.+))?$', path, re.IGNORECASE)
+    if match is None:
+        return None
+    return match.group(1), match.group(2)
+
+def is_csv_input(path):
+    """Whether path names something lil_lex.py can read as a CSV file."""
+    _, extension = os.path.splitext(path)
+    return (path == '-' or re.search(r'\.csv$', path) is not None or extension in openers
+            or split_zip_member(path) is not None)
+
+def needs_streaming(path):
+    # Whether path has to be read from start to finish (so it can't be
+    # sought through, split up, or handed to pyarrow).
+    return re.search(r'\.csv$', path) is None or split_zip_member(path) is not None
+
+def output_csv_path(path):
+    """Return the .csv path that the outputs for path (its data dictionary
+    and so on) are named after: data.csv for data.csv.gz, data.csv (next to
+    the archive) for archive.zip:some/data.csv, and stdin.csv for stdin."""
+    if path == '-':
+        return 'stdin.csv'
+    zip_member = split_zip_member(path)
+    if zip_member is not None:
+        archive, member = zip_member
+        if member is None:
+            member = zip_csv_member(archive)
+        base = os.path.join(os.path.dirname(archive), os.path.basename(member))
+    else:
+        base, extension = os.path.splitext(path)
+        if extension not in openers:
+            base = path
+    return base if re.search(r'\.csv$', base) is not None else f"{base}.csv"
+
+def zip_csv_member(archive):
+    with zipfile.ZipFile(archive) as z:
+        members = [name for name in z.namelist() if not name.endswith('/')]
+    csv_members = [name for name in members if re.search(r'\.csv$', name, re.IGNORECASE)]
+    if len(csv_members) == 1:
+        return csv_members[0]
+    if len(members) == 1:
+        return members[0]
+    raise ValueError(f"{archive} holds {len(csv_members)} CSV files, so say which one to read, like {archive}:{(csv_members or members)[0]}.")
+
+def open_binary(path):
+    """Open path (as described above) for reading decompressed bytes."""
+    if path == '-':
+        stdin = sys.stdin.buffer
+        start = stdin.peek(6)[:6] if hasattr(stdin, 'peek') else b''
+        for magic_number, decompressor in magic_numbers.items():
+            if start.startswith(magic_number):
+                return decompressor(stdin)
+        return stdin
+    zip_member = split_zip_member(path)
+    if zip_member is not None:
+        archive, member = zip_member
+        # The archive file stays open until the member is closed.
+        return zipfile.ZipFile(archive).open(member if member is not None else zip_csv_member(archive))
+    _, extension = os.path.splitext(path)
+    if extension in openers:
+        return openers[extension](path, 'rb')
+    return open(path, 'rb')
+
+def open_csv(path):
+    """Open path (as described above) as text, the way open(path) would open
+    a plain CSV file."""
+    if not needs_streaming(path):
+        return open(path)
+    return io.TextIOWrapper(io.BufferedReader(open_binary(path), buffer_size=1 << 20))
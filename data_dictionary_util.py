@@ -1,12 +1,60 @@
-import ckanapi
+import json, itertools, ckanapi, requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pprint
 from icecream import ic
+from ckan_cache import MetadataCache
+
+clients = {} # One shared client (with its pool of connections) per site and API key
+metadata_cache = MetadataCache() # Set metadata_cache.refresh or .enabled to bypass it.
+
+def get_client(site, API_key=None, pool_size=16):
+    """Return the shared ckanapi.RemoteCKAN for the site and API key, so that
+    all the requests to a site reuse the same HTTP connections."""
+    if (site, API_key) not in clients:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        clients[(site, API_key)] = ckanapi.RemoteCKAN(site, apikey=API_key, session=session)
+    return clients[(site, API_key)]
+
+def apply_cache_options(args):
+    """Set up metadata_cache from the refresh and no_cache command-line
+    options and return the rest of args. refresh ignores any cached CKAN
+    metadata (but still updates the cache); no_cache doesn't use the cache
+    at all."""
+    metadata_cache.refresh = 'refresh' in args
+    metadata_cache.enabled = 'no_cache' not in args
+    return [arg for arg in args if arg not in ['refresh', 'no_cache']]
+
+def get_resource_metadata(site, resource_id, API_key=None):
+    """Return the resource's metadata (from resource_show), using the cached
+    copy if it's recent enough."""
+    entry = metadata_cache.load('resource', site, resource_id)
+    if entry is not None and metadata_cache.is_fresh(entry):
+        return entry['value']
+    metadata = get_client(site, API_key).action.resource_show(id=resource_id)
+    metadata_cache.save('resource', site, resource_id, metadata, resource_version(metadata))
+    return metadata
+
+def get_package_metadata(site, package_id, API_key=None):
+    """Return the package's metadata (from package_show), using the cached
+    copy if it's recent enough."""
+    entry = metadata_cache.load('package', site, package_id)
+    if entry is not None and metadata_cache.is_fresh(entry):
+        return entry['value']
+    metadata = get_client(site, API_key).action.package_show(id=package_id)
+    metadata_cache.save('package', site, package_id, metadata, metadata.get('metadata_modified'))
+    return metadata
+
+def resource_version(metadata):
+    # A resource's fields can't have changed if neither of these has.
+    return [metadata.get('last_modified'), metadata.get('metadata_modified')]
 
 def get_fields(site, resource_id, API_key=None):
     try:
-        ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
-        results_dict = ckan.action.datastore_search(resource_id=resource_id, limit=0)
-        schema = results_dict['fields']
+        schema = get_data_dictionary(site, resource_id, API_key)
         fields = [d['id'] for d in schema]
     except:
         return None
@@ -36,23 +84,79 @@ def schema_dict(schema):
 
 def get_schema(site, resource_id, API_key=None):
     try:
-        ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
-        results_dict = ckan.action.datastore_search(resource_id=resource_id, limit=0)
-        schema = results_dict['fields']
+        schema = get_data_dictionary(site, resource_id, API_key)
     except:
         return None
 
     return schema
 
-def get_data_dictionary(site, resource_id, API_key=None):
+def get_data_dictionary(site, resource_id, API_key=None, use_cache=True):
+    """Return the resource's fields (with their data-dictionary info). A
+    cached copy is used if it's recent enough or if the resource's
+    last_modified and metadata_modified values haven't changed since it was
+    fetched. Pass use_cache=False to be sure to get the current fields."""
     try:
-        ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
-        results = ckan.action.datastore_search(resource_id=resource_id)
-        return results['fields']
+        entry = metadata_cache.load('fields', site, resource_id) if use_cache else None
+        version = None
+        if entry is not None:
+            if metadata_cache.is_fresh(entry):
+                return entry['value']
+            version = resource_version(get_resource_metadata(site, resource_id, API_key))
+            if version == entry['version']:
+                metadata_cache.save('fields', site, resource_id, entry['value'], version)
+                return entry['value']
+        ckan = get_client(site, API_key)
+        results = ckan.action.datastore_search(resource_id=resource_id, limit=0) # Just the fields, not any records
     except ckanapi.errors.NotFound: # Either the resource doesn't exist, or it doesn't have a datastore.
         return None
+    if version is None:
+        # Record which version of the resource these fields go with, if that's
+        # known without another request. (If not, they'll be fetched again
+        # the next time they're revalidated.)
+        resource_entry = metadata_cache.load('resource', site, resource_id)
+        if resource_entry is not None and metadata_cache.is_fresh(resource_entry):
+            version = resource_version(resource_entry['value'])
+    metadata_cache.save('fields', site, resource_id, results['fields'], version)
+    return results['fields']
+
+def csv_value(value):
+    # Render a datastore value the way it appears in the resource's CSV dump.
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return str(value)
 
-def set_data_dictionary(site, resource_id, ref_fields, API_key):
+def datastore_records(site, resource_id, API_key=None, page_size=10000, prefetch=2):
+    """Return the resource's fields and an iterator over its records (as
+    dicts of strings, like the rows of its CSV dump). The records are
+    fetched a page of page_size at a time, with up to prefetch pages being
+    fetched (in other threads) while the current one is used, so no more
+    than prefetch + 1 pages are held in memory."""
+    ckan = get_client(site, API_key)
+    def fetch(offset):
+        return ckan.action.datastore_search(resource_id=resource_id, limit=page_size, offset=offset, sort='_id')
+    first_page = fetch(0)
+    fields = first_page['fields']
+    total = first_page['total'] # The pages after the first are all fetched with this in mind.
+    def records():
+        names = [field['id'] for field in fields]
+        depth = max(prefetch, 1) # At least the next page has to be asked for.
+        with ThreadPoolExecutor(max_workers=depth) as executor:
+            offsets = iter(range(page_size, total, page_size))
+            pending = deque(executor.submit(fetch, offset) for offset in itertools.islice(offsets, depth))
+            page = first_page
+            while True:
+                for record in page['records']:
+                    yield {name: csv_value(record.get(name)) for name in names}
+                if len(pending) == 0:
+                    return
+                page = pending.popleft().result()
+                for offset in itertools.islice(offsets, 1):
+                    pending.append(executor.submit(fetch, offset))
+    return fields, records()
+
+def set_data_dictionary(site, resource_id, ref_fields, API_key, present_fields=None):
     # Here "ref_fields" needs to be in the same format as the data dictionary
     # returned by get_data_dictionary: a list of type dicts and info dicts.
     # Though the '_id" field needs to be removed for this to work.
@@ -60,25 +164,34 @@ def set_data_dictionary(site, resource_id, ref_fields, API_key):
     # ref_fields can be the old fields from a data table that is being cleared
     # or newly synthesized fields from a CSV data-dictionary specification.
     # In the latter case, the type_override field may be present.
+
+    # present_fields (the destination's current data dictionary) can be
+    # passed if the caller already has it, to save fetching it again.
     if ref_fields[0]['id'] == '_id':
         ref_fields = ref_fields[1:]
 
     # Note that a subset can be sent, and they will update part of
     # the integrated data dictionary.
-    ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
-    present_fields = get_data_dictionary(site, resource_id, API_key)
+    ckan = get_client(site, API_key)
+    if present_fields is None:
+        present_fields = get_data_dictionary(site, resource_id, API_key, use_cache=False)
+    definitions = {} # This contains both the label and the definition.
+    for f in ref_fields:
+        definitions.setdefault(f['id'], f.get('info', None)) # The first one wins, as with next().
     new_fields = []
     # Attempt to set data-dictionary values, taking into account the deletion and addition of fields, and ignoring any changes in type.
     # Iterate through the fields in the data dictionary and try to apply them to the newly created data table.
     for field in present_fields:
         if field['id'] != '_id':
-            definition = next((f.get('info', None) for f in ref_fields if f['id'] == field['id']), None) # This contains both the label and the definition.
+            definition = definitions.get(field['id'])
             nf = dict(field)
             if definition is not None:
                 nf['info'] = definition
             new_fields.append(nf)
 
     results = ckan.action.datastore_create(resource_id=resource_id, fields=new_fields, force=True)
+    metadata_cache.invalidate('fields', site, resource_id)
+    metadata_cache.invalidate('resource', site, resource_id)
     # The response without force=True is
     # ckanapi.errors.ValidationError: {'__type': 'Validation Error', 'read-only': 
     #  ['Cannot edit read-only resource. Either pass "force=True" or change url-type to "datastore"']}
@@ -86,9 +199,15 @@ def set_data_dictionary(site, resource_id, ref_fields, API_key):
 
     return results
 
-def compare_schemas(site, source_resource_id, destination_resource_id, API_key):
-    source_schema_dict = schema_dict(get_schema(site, source_resource_id, API_key))
-    destination_schema_dict = schema_dict(get_schema(site, destination_resource_id, API_key))
+def compare_schemas(site, source_resource_id, destination_resource_id, API_key, source_schema=None, destination_schema=None):
+    # The schemas (or data dictionaries, which include them) can be passed
+    # if the caller already has them, to save fetching them again.
+    if source_schema is None:
+        source_schema = get_schema(site, source_resource_id, API_key)
+    if destination_schema is None:
+        destination_schema = get_schema(site, destination_resource_id, API_key)
+    source_schema_dict = schema_dict(source_schema)
+    destination_schema_dict = schema_dict(destination_schema)
 
     source_fields = source_schema_dict.keys()
     destination_fields = destination_schema_dict.keys()
@@ -117,21 +236,24 @@ def compare_schemas(site, source_resource_id, destination_resource_id, API_key):
 def clone_data_dictionary(site, source_resource_id, destination_resource_id, API_key):
     """This function takes the integrated data dictionary from the source resource 
     and attempts to apply it to the destination resource."""
+    # Each resource's fields are fetched once and reused for the schema
+    # comparison and the update, so a clone takes three requests (two reads
+    # and a write).
 
     fields = get_data_dictionary(site, source_resource_id, API_key)
     if fields is None:
         raise ValueError(f"Unable to get a data dictionary from the CKAN resource with ID {source_resource_id} (the source table).")
-    destination_fields = get_data_dictionary(site, destination_resource_id, API_key)
+    destination_fields = get_data_dictionary(site, destination_resource_id, API_key, use_cache=False) # It's about to be overwritten.
     if destination_fields is None:
         raise ValueError(f"Unable to get a data dictionary from the CKAN resource with ID {destination_resource_id} (the destination table).")
 
     # Verify that data dictionary can be applied to the destination.
-    schemas_match = compare_schemas(site, source_resource_id, destination_resource_id, API_key)
+    schemas_match = compare_schemas(site, source_resource_id, destination_resource_id, API_key, fields, destination_fields)
 
     # Regardless of the degree of matching between the schemas, try to apply as 
     # many of the source definitions as possible.
     print("Overwriting destination table's data dictionary with any matching fields from the source table's data dictionary.\n")
-    results = set_data_dictionary(site, destination_resource_id, fields, API_key)
+    results = set_data_dictionary(site, destination_resource_id, fields, API_key, destination_fields)
     return results
 
 if __name__ == '__main__':
@@ -2,7 +2,7 @@ import sys, csv
 from credentials import site, API_key # Use sample-credentials.py as a model for creating this file.
 from pprint import pprint
 from icecream import ic
-from data_dictionary_util import clone_data_dictionary, set_data_dictionary, get_data_dictionary
+from data_dictionary_util import clone_data_dictionary, set_data_dictionary, get_data_dictionary, apply_cache_options
 from lil_lex import base_schema_type
 
 def write_to_csv(filename, list_of_dicts, keys=None):
@@ -71,12 +71,13 @@ def convert_fields_to_list_of_dicts(fields):
     return rows
 
 if __name__ == '__main__':
-    if len(sys.argv) not in [2, 3]:
-        raise ValueError("Please specify the resource ID of the CKAN table that is the source for the integrated data dictionary.\nUsage:\n   > python download_data_dictionary.py <CKAN resource ID>")
-    source_resource_id = sys.argv[1]
+    args = apply_cache_options(sys.argv[1:])
+    if len(args) not in [1, 2]:
+        raise ValueError("Please specify the resource ID of the CKAN table that is the source for the integrated data dictionary.\nUsage:\n   > python download_data_dictionary.py <CKAN resource ID> [output file] [refresh] [no_cache]")
+    source_resource_id = args[0]
     save_filename =  f'{source_resource_id}-data-dictionary.csv'
-    if len(sys.argv) == 3:
-        save_filename = sys.argv[2]
+    if len(args) == 2:
+        save_filename = args[1]
 
     fields = get_data_dictionary(site, source_resource_id, API_key)
 
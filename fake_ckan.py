@@ -0,0 +1,183 @@
+# A local stand-in for a CKAN instance's action API, for trying out the data
+# dictionary scripts (and measuring how many requests they make) without
+# data.wprdc.org or an API key.
+#
+#   > python fake_ckan.py [port=5000] [latency=0.05] [failure_rate=0.1] [resources=N]
+#
+# serves a sample package with N datastore resources (3 by default) at
+# http://localhost:5000 until interrupted; point site in credentials.py at it
+# (any API key will do). latency is added to every request (in seconds), and
+# failure_rate is the fraction of requests that get an HTML 503 error page
+# instead of an answer, like an overloaded proxy would return.
+#
+# Only datastore_search, datastore_create, resource_show, package_show, and
+# package_search are implemented, and only as far as these scripts use them.
+import re, sys, json, time, random, threading, datetime
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qsl
+
+class ActionError(Exception):
+    def __init__(self, status, error_type, message):
+        self.status = status
+        self.error = {'__type': error_type, 'message': message}
+
+def now():
+    return datetime.datetime.now().isoformat()
+
+class FakeCKAN:
+    """Holds packages and datastore resources in memory and serves them over
+    HTTP (from start() until stop()), counting the requests for each action
+    in calls."""
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.packages = {}
+        self.resources = {}
+        self.calls = Counter()
+        self.lock = threading.Lock()
+        self.server = None
+
+    def add_resource(self, resource_id, fields, records=None, package_id='sample-package', url_type=None):
+        """Add a datastore resource with the given fields (dicts with 'id',
+        'type', and optionally 'info', not including _id)."""
+        records = [dict(record, _id=k + 1) for k, record in enumerate(records or [])]
+        self.resources[resource_id] = {
+                'metadata': {'id': resource_id, 'package_id': package_id, 'name': resource_id, 'datastore_active': True,
+                    'url_type': url_type, 'last_modified': now(), 'metadata_modified': now(), 'format': 'CSV'},
+                'fields': [{'id': '_id', 'type': 'int'}] + [dict(field) for field in fields],
+                'records': records}
+        package = self.packages.setdefault(package_id, {'id': package_id, 'name': package_id, 'title': package_id,
+            'organization': {'name': 'sample-organization'}, 'metadata_modified': now()})
+        package['metadata_modified'] = now()
+        return resource_id
+
+    def resource(self, resource_id):
+        if resource_id not in self.resources:
+            raise ActionError(404, 'Not Found Error', f'Not found: Resource "{resource_id}" was not found.')
+        return self.resources[resource_id]
+
+    def package(self, package_id):
+        if package_id not in self.packages:
+            raise ActionError(404, 'Not Found Error', 'Not found')
+        package = dict(self.packages[package_id])
+        package['resources'] = [dict(r['metadata']) for r in self.resources.values() if r['metadata']['package_id'] == package_id]
+        package['num_resources'] = len(package['resources'])
+        return package
+
+    def datastore_search(self, resource_id, limit=100, offset=0, **kwargs):
+        resource = self.resource(resource_id)
+        limit, offset = int(limit), int(offset)
+        return {'resource_id': resource_id, 'fields': [dict(f) for f in resource['fields']],
+                'records': resource['records'][offset:offset + limit], 'total': len(resource['records']),
+                'limit': limit, 'offset': offset}
+
+    def datastore_create(self, resource_id, fields=None, records=None, force=False, **kwargs):
+        resource = self.resource(resource_id)
+        if not force and resource['metadata']['url_type'] != 'datastore':
+            raise ActionError(409, 'Validation Error', {'read-only': ['Cannot edit read-only resource. Either pass "force=True" or change url-type to "datastore"']})
+        # As with a real datastore, only the info of existing fields can be
+        # changed this way, and new fields are added at the end.
+        by_id = {f['id']: f for f in resource['fields']}
+        for field in fields or []:
+            if field['id'] in by_id:
+                if 'info' in field:
+                    by_id[field['id']]['info'] = field['info']
+            else:
+                resource['fields'].append(dict(field))
+        resource['records'] += [dict(record, _id=len(resource['records']) + k + 1) for k, record in enumerate(records or [])]
+        resource['metadata']['metadata_modified'] = now()
+        return {'resource_id': resource_id, 'fields': [dict(f) for f in resource['fields'][1:]], 'method': 'insert'}
+
+    def resource_show(self, id, **kwargs):
+        return dict(self.resource(id)['metadata'])
+
+    def package_show(self, id, **kwargs):
+        return self.package(id)
+
+    def package_search(self, fq='', rows=10, start=0, **kwargs):
+        organization = re.match(r'organization:(.*)$', fq)
+        packages = [self.package(package_id) for package_id, p in self.packages.items()
+                if organization is None or p['organization']['name'] == organization.group(1)]
+        return {'count': len(packages), 'results': packages[int(start):int(start) + int(rows)]}
+
+    actions = ['datastore_search', 'datastore_create', 'resource_show', 'package_show', 'package_search']
+
+    def call(self, action, data_dict):
+        """Return the HTTP status and the JSON (or HTML) body of the response."""
+        with self.lock:
+            self.calls[action] += 1
+            fails = self.random.random() < self.failure_rate
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if fails:
+            return 503, '<html><body><h1>503 Service Unavailable</h1></body></html>'
+        if action not in self.actions:
+            return 400, json.dumps({'success': False, 'error': {'__type': 'Bad request', 'message': f'Action name not known: {action}'}})
+        try:
+            with self.lock:
+                result = getattr(self, action)(**data_dict)
+        except ActionError as e:
+            return e.status, json.dumps({'success': False, 'error': e.error})
+        except TypeError as e: # Missing or unexpected parameters
+            return 409, json.dumps({'success': False, 'error': {'__type': 'Validation Error', 'message': str(e)}})
+        return 200, json.dumps({'success': True, 'result': result})
+
+    def round_trips(self):
+        return sum(self.calls.values())
+
+    def start(self, port=0):
+        """Start serving in a background thread and return the site address."""
+        fake = self
+        class Handler(BaseHTTPRequestHandler):
+            def respond(self, data_dict):
+                match = re.match(r'/api/(?:3/)?action/(\w+)$', urlparse(self.path).path)
+                status, body = fake.call(match.group(1), data_dict) if match else (404, 'Not found')
+                body = body.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json' if body.startswith(b'{') else 'text/html')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self.respond(dict(parse_qsl(urlparse(self.path).query)))
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                self.respond(json.loads(self.rfile.read(length) or b'{}'))
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def sample_fields(count, seed=0):
+    rng = random.Random(seed)
+    types = ['text', 'int', 'numeric', 'timestamp', 'date', 'bool']
+    return [{'id': f'field_{k}', 'type': rng.choice(types),
+        'info': {'label': f'Field {k}', 'notes': f'What field {k} means', 'type_override': ''}} for k in range(count)]
+
+if __name__ == '__main__':
+    options = {'port': 5000, 'latency': 0.0, 'failure_rate': 0.0, 'resources': 3}
+    for arg in sys.argv[1:]:
+        key, _, value = arg.partition('=')
+        if key in options:
+            options[key] = type(options[key])(value)
+    fake = FakeCKAN(options['latency'], options['failure_rate'])
+    for k in range(options['resources']):
+        fake.add_resource(f'sample-resource-{k}', sample_fields(10, seed=k), [{f'field_{j}': str(j) for j in range(10)}]*5)
+    site = fake.start(options['port'])
+    print(f"Serving a fake CKAN instance with {options['resources']} resources at {site} (Ctrl-C to stop).")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        fake.stop()
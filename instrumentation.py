@@ -0,0 +1,67 @@
+# Timing and progress reporting for a run of lil_lex.py (its profile option).
+import sys, time
+
+class RunProfiler:
+    """Records how long each phase of a run takes (each phase ending when the
+    next one does) and reports progress through the rows on stderr."""
+    def __init__(self, reports_progress=False, progress_interval=1.0):
+        self.started = self.last_lap = time.perf_counter()
+        self.phases = {}
+        self.rows = 0
+        self.read_seconds = None # Time spent waiting for the rows passed through track
+        self.reports_progress = reports_progress
+        self.progress_interval = progress_interval # Seconds between progress reports
+
+    def end_phase(self, name):
+        now = time.perf_counter()
+        self.phases[name] = self.phases.get(name, 0.0) + now - self.last_lap
+        self.last_lap = now
+
+    def end_profile_phase(self):
+        """End the phase of reading and profiling the rows. If they were
+        passed through track, it's split into reading them (parsing the CSV
+        file) and profiling them (the per-column type inference). Otherwise
+        (when the rows are read in other processes or by pyarrow), the two
+        can't be told apart, so it's just 'profile'."""
+        if self.read_seconds is None:
+            self.end_phase('profile')
+            return
+        now = time.perf_counter()
+        self.phases['read'] = self.read_seconds
+        self.phases['per-column inference'] = now - self.last_lap - self.read_seconds
+        self.last_lap = now
+
+    def track(self, rows, binary_file, total_bytes):
+        """Pass rows through, counting them and writing the rows per second
+        and the estimated time left (from how far into binary_file reading
+        has gotten) to stderr every so often, and timing how long each row
+        takes to read."""
+        start = next_report = time.perf_counter()
+        self.read_seconds = 0.0
+        rows = iter(rows)
+        while True:
+            before = time.perf_counter()
+            row = next(rows, None)
+            self.read_seconds += time.perf_counter() - before
+            if row is None:
+                return
+            self.rows += 1
+            if self.rows % 1000 == 0 and time.perf_counter() >= next_report:
+                now = time.perf_counter()
+                elapsed = now - start
+                fraction = binary_file.tell()/total_bytes if total_bytes > 0 else 1.0
+                eta = elapsed*(1 - fraction)/fraction if fraction > 0 else 0.0
+                print(f"{self.rows} rows ({fraction:.0%} of the file), {self.rows/elapsed if elapsed > 0 else 0:.0f} rows/s, about {eta:.0f} s left",
+                    file=sys.stderr)
+                next_report = now + self.progress_interval
+            yield row
+
+    def summary(self, row_count, extra=None):
+        total = time.perf_counter() - self.started
+        profile_time = sum(self.phases.get(phase, 0.0) for phase in ['profile', 'read', 'per-column inference'])
+        results = {'total_seconds': total,
+                'phase_seconds': self.phases,
+                'rows': row_count,
+                'rows_per_second': row_count/profile_time if profile_time > 0 else None}
+        results.update(extra or {})
+        return results
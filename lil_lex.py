@@ -1,17 +1,52 @@
-import re, sys, csv, pprint
+import re, os, io, sys, csv, json, math, random, pickle, pprint, warnings, itertools, contextlib
 
 from icecream import ic
 from beartype import beartype
 from typing import Tuple
 
 from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from hashlib import blake2b
+from concurrent.futures import ProcessPoolExecutor
+from sketches import HyperLogLog, QuantileSketch, add_to_heavy_hitters, trim_heavy_hitters
+from composite_keys import find_composite_keys
+from column_store import ColumnStore
+from instrumentation import RunProfiler
+from csv_input import is_csv_input, needs_streaming, output_csv_path, open_csv
 from dateutil import parser
 
+try: # Only needed for backend=arrow and Parquet, Arrow, and Feather files.
+    import pyarrow, pyarrow.csv, pyarrow.compute, pyarrow.ipc, pyarrow.feather, pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
 type_hierarchy = {None: -1, 'text': 0, 'bool': 1, 'int': 2, 'float': 3, 'datetime': 4, 'date': 4} # Ranked by test stringency
+type_options = ['text', 'int', 'float', 'bool', 'datetime', 'date'] #'json', 'time']
+type_bits = {option: 1 << k for k, option in enumerate(type_options)} # For sets of candidate types stored as bitmasks
+all_types = sum(type_bits.values())
+date_types = type_bits['date'] | type_bits['datetime']
+type_test_counts = None # For the profile option: how many values were tested for each type, and how many passed
+
+def new_type_test_counts():
+    return {option: {'tested': 0, 'passed': 0} for option in type_options}
+
+def count_type_tests(candidates, compatible):
+    for option in type_options:
+        if candidates & type_bits[option]:
+            type_test_counts[option]['tested'] += 1
+            type_test_counts[option]['passed'] += bool(compatible & type_bits[option])
 
-def test_type(value,candidate):
+def add_type_test_counts(counts):
+    # Add the counts from another process.
+    for option, option_counts in counts.items():
+        for key, count in option_counts.items():
+            type_test_counts[option][key] += count
+
+def test_type(value, candidate, warnings=None):
     """Return True if the value might be of type candidate and False only if it is
-    definitely not of type candidate."""
+    definitely not of type candidate. If a warnings list is passed, any warning
+    about the value is appended to it instead of being printed."""
     if value in ['', 'NA', 'N/A', 'NULL']:
         return True
     if candidate == 'datetime':
@@ -78,7 +113,11 @@ def test_type(value,candidate):
         ##         return True
         # Examples of scientific notation to detect: 3e+05, 2e-04
         if re.match(r'^-?\d\.\d+[eE][+-]*\d+$', value) is not None or re.match(r'^-?\d+[eE][+-]*\d+$', value) is not None:
-            print(f"{value} looks like it is in scientific notation! Because of the way the float type works, it's probably best to keep this as a string to avoid mangling precision. [Actually, this is a judgment call that depends on the situation. Marshmallow WILL convert 2e-4 to 0.0002.]")
+            warning = scientific_notation_warning(value)
+            if warnings is None:
+                print(warning)
+            else:
+                warnings.append(warning)
             return False
 
         return False
@@ -96,6 +135,69 @@ def test_type(value,candidate):
     # Dates, times, and datetimes are more difficult to deal with.
     # I'll also save JSON for later.
 
+def scientific_notation_warning(value):
+    return f"{value} looks like it is in scientific notation! Because of the way the float type works, it's probably best to keep this as a string to avoid mangling precision. [Actually, this is a judgment call that depends on the situation. Marshmallow WILL convert 2e-4 to 0.0002.]"
+
+# Precompiled versions of the patterns used by test_type, for classify.
+int_pattern = re.compile(r'^-?\d+$')
+float_patterns = [re.compile(r'^-?\d*\.\d+$'), re.compile(r'^-?\d+\.\d*$')]
+scientific_notation_patterns = [re.compile(r'^-?\d\.\d+[eE][+-]*\d+$'), re.compile(r'^-?\d+[eE][+-]*\d+$')]
+bool_values = {'0', 'False', 'false', '1', 'True', 'true'}
+# A value can only pass the date or datetime test if it's identical to the
+# output of isoformat() (possibly with a space instead of the 'T'), so
+# anything that doesn't have that shape can skip the (slow) parser.
+iso_date_shape = re.compile(r'[0-9]{4}-[0-9]{2}-[0-9]{2}')
+iso_datetime_shape = re.compile(r'[0-9]{4}-[0-9]{2}-[0-9]{2}[T ][0-9]{2}:[0-9]{2}:[0-9]{2}(\.[0-9]{6})?([+-][0-9]{2}:[0-9]{2}(:[0-9]{2}(\.[0-9]{6})?)?)?')
+
+@lru_cache(maxsize=100000)
+def parse_datetime(value):
+    """Parse a date or datetime string the way test_type does, but try
+    datetime.fromisoformat (which is much faster than dateutil) first. Results
+    are cached so that no string needs to be parsed twice. Returns None if
+    the value can't be parsed."""
+    try:
+        x = datetime.fromisoformat(value)
+        # Only trust the fast path when it round-trips; dateutil parses such
+        # strings identically (except for UTC offsets with seconds, which it
+        # doesn't handle the same way). Anything else goes to dateutil.
+        if x.isoformat() == value or x.isoformat() == value.replace(' ', 'T'):
+            if x.utcoffset() is None or x.utcoffset() % timedelta(minutes=1) == timedelta(0):
+                return x
+    except ValueError:
+        pass
+    try:
+        return parser.parse(value)
+    except Exception:
+        return None
+
+def is_scientific_notation(value):
+    return any(pattern.match(value) is not None for pattern in scientific_notation_patterns)
+
+@lru_cache(maxsize=100000) # Shared by all fields, which helps with the high-cardinality ones.
+def classify(value):
+    """Return (as a bitmask of type_bits) all the types that test_type would
+    say value might be, testing each pattern once and parsing dates at most
+    once."""
+    if value in ['', 'NA', 'N/A', 'NULL']:
+        return all_types
+    compatible = type_bits['text']
+    if int_pattern.match(value) is not None:
+        if not (value[0] == '0' and value.strip() != '0' and '.' not in value):
+            compatible |= type_bits['int']
+    if float_patterns[0].match(value) is not None or float_patterns[1].match(value) is not None:
+        compatible |= type_bits['float']
+    if value in bool_values:
+        compatible |= type_bits['bool']
+    if iso_date_shape.fullmatch(value) is not None or iso_datetime_shape.fullmatch(value) is not None:
+        x = parse_datetime(value)
+        if x is None:
+            return compatible
+        if x.isoformat() == value or x.isoformat() == value.replace(' ', 'T'):
+            compatible |= type_bits['datetime']
+        if x.date().isoformat() == value:
+            compatible |= type_bits['date']
+    return compatible
+
 def date_or_datetime(options,values):
     # Distinguishing between dates and datetimes could be done on length, but data that comes in like
     # 2017-04-13 00:00 (with all times equal to midnight) are actually dates.
@@ -103,21 +205,28 @@ def date_or_datetime(options,values):
         return 'date'
     for v in values:
         if v not in ['', 'NA', 'N/A', 'NULL', None]:
-            dt = parser.parse(v)
+            dt = parse_datetime(v) or parser.parse(v) # (The latter raises the parsing error.)
             if not(dt.hour == dt.minute == dt.second == 0):
                 return 'datetime'
     return 'date'
 
-def choose_type(options, values, fieldname):
+def most_stringent_type(options):
     selection = None
     for option in options:
         if type_hierarchy[option] > type_hierarchy[selection]:
             selection = option
+    return selection
+
+def choose_type(options, values, fieldname, date_type=None):
+    # If the caller has already worked out whether a date/datetime field is
+    # really a date or a datetime (as FieldProfile does while scanning),
+    # it can pass that as date_type to avoid another look at the values.
+    selection = most_stringent_type(options)
 
     # Distinguishing between dates and datetimes could be done on length, but data that comes in like
     # 2017-04-13 00:00 (with all times equal to midnight) are actually dates.
     if selection in ['datetime', 'date']:
-        selection = date_or_datetime(options,values)
+        selection = date_type or date_or_datetime(options,values)
 
     if fieldname.lower() in ['zip', 'zipcode', 'zip_code', 'zip code', 'ward', 'council_district', 'police_zone', 'fire_zone'] or 'zip_code' in fieldname.lower() or 'zip code' in fieldname.lower():
         if selection == 'int':
@@ -143,6 +252,12 @@ base_schema_type = {'text': 'String',
 types_no_integers = dict(base_schema_type)
 types_no_integers['int'] = 'String'
 
+# The types that CKAN datastore column types correspond to (for comparing the
+# inferred types of a datastore table's fields with its actual ones)
+datastore_types = {'text': 'text', 'int': 'int', 'int2': 'int', 'int4': 'int', 'int8': 'int',
+        'numeric': 'float', 'float4': 'float', 'float8': 'float', 'bool': 'bool',
+        'timestamp': 'datetime', 'timestamptz': 'datetime', 'date': 'date'}
+
 # Dates, datetimes, and booleans need to be inferred.
 
 def detect_case(s):
@@ -214,6 +329,947 @@ def is_unique(xs):
         return False
     return True
 
+def number_string(x):
+    return str(x) if isinstance(x, int) else f"{x:.6g}"
+
+def sort_key(dt):
+    # Datetimes with time zones are compared in UTC (and those without are
+    # taken to be in UTC), since aware and naive ones can't be compared.
+    return dt.astimezone(timezone.utc).replace(tzinfo=None) if dt.tzinfo is not None else dt
+
+def sub_microseconds(value):
+    # The fraction of a microsecond in a datetime string with more than six
+    # digits of fractional seconds (like those of Arrow's nanosecond
+    # timestamps), which parse_datetime's results can't hold.
+    match = re.search(r'\.\d{6}(\d+)', value)
+    return int(match.group(1))/10**len(match.group(1)) if match is not None else 0.0
+
+class ColumnStats:
+    """Running statistics for a column's non-null values: the range of their
+    lengths, the range, mean, standard deviation, and quartiles of those
+    that are finite numbers, and the earliest and latest of those that are
+    dates or datetimes. The memory used doesn't grow with the number of
+    values (unless quantile_size is None, which makes the quartiles exact)."""
+    def __init__(self, quantile_size=1000):
+        self.min_length = self.max_length = None
+        self.count = 0 # Of the numbers
+        self.mean = self.m2 = 0.0 # For Welford's algorithm
+        self.min = self.max = None # (number, value) pairs
+        self.sketch = QuantileSketch(quantile_size)
+        self.earliest = self.latest = None # (sort key, value) pairs
+
+    def add(self, value, count=1, compatible=None):
+        """Add value (count times). compatible (the classify() result) says
+        whether it's a number or a date, and is looked up if it isn't given."""
+        if value in [None, '', 'NA', 'N/A', 'NULL']:
+            return
+        length = len(value)
+        if self.min_length is None or length < self.min_length:
+            self.min_length = length
+        if self.max_length is None or length > self.max_length:
+            self.max_length = length
+        if compatible is None:
+            compatible = classify(value)
+        if compatible & (type_bits['int'] | type_bits['float']):
+            x = int(value) if compatible & type_bits['int'] else float(value)
+            if isinstance(x, float) and not math.isfinite(x):
+                return # A NaN or infinity (from a declared float column), which would spoil the mean and quartiles
+            self.count += count
+            delta = x - self.mean
+            self.mean += delta*count/self.count
+            self.m2 += count*delta*(x - self.mean)
+            if self.min is None or x < self.min[0]:
+                self.min = (x, value)
+            if self.max is None or x > self.max[0]:
+                self.max = (x, value)
+            self.sketch.add(x, count)
+        if compatible & date_types:
+            dt = parse_datetime(value)
+            if dt is None:
+                return # A declared date that datetime can't hold (like one after the year 9999)
+            key = (sort_key(dt), sub_microseconds(value))
+            if self.earliest is None or key < self.earliest[0]:
+                self.earliest = (key, value)
+            if self.latest is None or key > self.latest[0]:
+                self.latest = (key, value)
+
+    def merge(self, other):
+        if self.min_length is None or (other.min_length is not None and other.min_length < self.min_length):
+            self.min_length = other.min_length
+        if self.max_length is None or (other.max_length is not None and other.max_length > self.max_length):
+            self.max_length = other.max_length
+        if other.count > 0:
+            count = self.count + other.count
+            delta = other.mean - self.mean
+            self.mean += delta*other.count/count
+            self.m2 += other.m2 + delta*delta*self.count*other.count/count
+            self.count = count
+        for attribute, better in [('min', min), ('max', max), ('earliest', min), ('latest', max)]:
+            pairs = [pair for pair in [getattr(self, attribute), getattr(other, attribute)] if pair is not None]
+            setattr(self, attribute, better(pairs, key=lambda pair: pair[0]) if pairs else None)
+        self.sketch.merge(other.sketch)
+
+    def summary(self, field_type):
+        """Return the statistics that make sense for a field of field_type,
+        as strings."""
+        summary = {'min_length': self.min_length, 'max_length': self.max_length}
+        if field_type in ['int', 'float'] and self.count > 0:
+            summary.update({'min': self.min[1], 'max': self.max[1], 'mean': number_string(self.mean),
+                'std': number_string((self.m2/(self.count - 1))**0.5) if self.count > 1 else None,
+                'quartiles': [number_string(x) for x in self.sketch.quantiles([0.25, 0.5, 0.75])],
+                'quartiles_estimated': not self.sketch.exact})
+        if field_type in ['date', 'datetime'] and self.earliest is not None:
+            summary.update({'earliest': self.earliest[1], 'latest': self.latest[1]})
+        return summary
+
+class FieldProfile:
+    """Running state for one column. Values are counted as they stream by,
+    and only the first occurrence of each distinct value gets type-tested, so
+    a CSV file can be profiled in a single pass without keeping its rows in
+    memory, and a column with a handful of distinct values costs little more
+    than counting them."""
+    def __init__(self, field):
+        self.field = field
+        self.candidates = all_types # A bitmask of the types not yet ruled out
+        self.value_example = None
+        self.has_time_of_day = False # Whether any date/datetime value is not at midnight
+        self.warnings = [] # Printed when the field is reported, just as test_type would have.
+        self.value_distribution = {}
+
+    def update(self, value):
+        distribution = self.value_distribution
+        if value in distribution:
+            distribution[value] += 1
+        else:
+            distribution[value] = 1
+            self.add_distinct_value(value)
+
+    def update_counts(self, values, counts, compatibles=None):
+        """Count many values at once (each counts times), in the order that
+        they first appear. If compatibles is given, it holds the classify()
+        result for each value, as worked out in advance."""
+        distribution = self.value_distribution
+        new_values = [k for k, value in enumerate(values) if value not in distribution]
+        for value, count in zip(values, counts):
+            distribution[value] = distribution.get(value, 0) + count
+        for k in new_values:
+            if self.candidates == type_bits['text'] and self.value_example is not None:
+                break # Nothing more to learn from the new values.
+            if compatibles is None:
+                self.add_distinct_value(values[k])
+            elif (compatibles[k] & self.candidates != self.candidates or self.value_example is None
+                    or (self.candidates & date_types and not self.has_time_of_day)):
+                self.add_distinct_value(values[k], compatibles[k]) # Otherwise it would change nothing.
+            elif type_test_counts is not None:
+                count_type_tests(self.candidates, compatibles[k]) # As add_distinct_value would have
+
+    def add_distinct_value(self, value, compatible=None):
+        # Distinct values arrive in the order that they first appear in, so
+        # the first non-null one is the first non-null value in the column.
+        if value not in [None, '', 'NA', 'NULL'] and self.value_example is None:
+            self.value_example = value
+        # Type elimination by brute force. Once only 'text' is left (and it
+        # can't be ruled out), there's nothing to test, and all that's needed
+        # from the rest of the values are their counts.
+        if value is not None and self.candidates != type_bits['text']:
+            if compatible is None:
+                compatible = classify(value)
+            if type_test_counts is not None:
+                count_type_tests(self.candidates, compatible)
+            if self.candidates & ~compatible & type_bits['float'] and is_scientific_notation(value):
+                self.warnings.append(scientific_notation_warning(value))
+            self.candidates &= compatible
+            # [ ] This type-detection scheme fails to detect non-strings when 'NA' values are present.
+
+            # Keep track of what date_or_datetime would decide. Only values
+            # longer than a date (len('2019-04-13') == 10) can have times,
+            # and their parsing results are still in parse_datetime's cache.
+            if compatible & self.candidates & date_types and len(value) > 10 and not self.has_time_of_day:
+                dt = parse_datetime(value)
+                if not(dt.hour == dt.minute == dt.second == 0):
+                    self.has_time_of_day = True
+
+    @property
+    def none_count(self):
+        return sum(self.value_distribution.get(v, 0) for v in [None, '', 'NA', 'NULL'])
+
+    @property
+    def row_count(self):
+        return sum(self.value_distribution.values())
+
+    def type_candidates(self):
+        return [x for x in type_options if self.candidates & type_bits[x]]
+
+    def date_type(self):
+        return 'datetime' if self.has_time_of_day else 'date'
+
+    def field_values(self):
+        # The distinct values are all that date_or_datetime needs to look at.
+        return list(self.value_distribution)
+
+    def has_nas(self):
+        return 'NA' in self.value_distribution or 'NULL' in self.value_distribution
+
+    def is_unique(self):
+        return all(count == 1 for count in self.value_distribution.values())
+
+    def merge(self, other):
+        """Fold in the profile of the same field from the rows that come right
+        after the ones this profile has seen, leaving this profile in the same
+        state as if it had seen all of those rows itself."""
+        if self.candidates & type_bits['float']:
+            # Otherwise the float type was ruled out before any value in
+            # other could have triggered a warning.
+            self.warnings += other.warnings
+        self.candidates &= other.candidates
+        self.has_time_of_day = self.has_time_of_day or other.has_time_of_day
+        if self.value_example is None:
+            self.value_example = other.value_example
+        distribution = self.value_distribution
+        for value, count in other.value_distribution.items():
+            distribution[value] = distribution.get(value, 0) + count
+
+    def is_estimate(self):
+        return False
+
+    def distinct_count(self):
+        return len(self.value_distribution)
+
+    def statistics(self, field_type):
+        """Work out the ColumnStats of the field from its value distribution
+        (exactly), given that every non-null value is of field_type."""
+        stats = ColumnStats(quantile_size=None)
+        compatible = type_bits[field_type]
+        for value, count in self.value_distribution.items():
+            stats.add(value, count, compatible)
+        return stats
+
+class BoundedFieldProfile(FieldProfile):
+    """A FieldProfile that keeps counts for at most capacity distinct values.
+    Once a field has more distinct values than that, its value distribution
+    only holds (lower bounds on) the counts of its most common values, and
+    uniqueness and the number of distinct values are estimated. Types, the
+    example value, none counts and NA flags stay exact."""
+    def __init__(self, field, capacity, statistics=False):
+        super().__init__(field)
+        self.capacity = capacity
+        self.rows = 0
+        self.null_counts = defaultdict(int)
+        self.distinct_values = HyperLogLog()
+        self.overflowed = False
+        # The value distribution is incomplete, so the statistics (if they're
+        # wanted) have to be kept as the rows go by.
+        self.stats = ColumnStats() if statistics else None
+
+    def update(self, value):
+        self.rows += 1
+        if value in [None, '', 'NA', 'NULL']:
+            self.null_counts[value] += 1
+        if value not in self.value_distribution:
+            # This may be the second time the value has been added (if its
+            # count was dropped), but adding a value is idempotent.
+            self.add_distinct_value(value)
+            self.distinct_values.add(value)
+        if add_to_heavy_hitters(self.value_distribution, value, self.capacity):
+            self.overflowed = True
+        if self.stats is not None:
+            self.stats.add(value)
+
+    @property
+    def none_count(self):
+        return sum(self.null_counts.values())
+
+    @property
+    def row_count(self):
+        return self.rows
+
+    def has_nas(self):
+        return 'NA' in self.null_counts or 'NULL' in self.null_counts
+
+    def is_estimate(self):
+        return self.overflowed
+
+    def distinct_count(self):
+        if not self.overflowed:
+            return len(self.value_distribution)
+        return self.distinct_values.estimate()
+
+    def statistics(self, field_type):
+        return self.stats
+
+    def is_unique(self):
+        if any(count > 1 for count in self.value_distribution.values()):
+            return False # Counts are lower bounds, so this is certain.
+        if not self.overflowed:
+            return True
+        # Call it unique if the estimated number of distinct values is
+        # within three standard errors of the number of rows.
+        return self.distinct_count() >= self.rows*(1 - 3*self.distinct_values.relative_error())
+
+    def merge(self, other):
+        super().merge(other)
+        self.rows += other.rows
+        for value, count in other.null_counts.items():
+            self.null_counts[value] += count
+        self.distinct_values.merge(other.distinct_values)
+        if self.stats is not None and other.stats is not None:
+            self.stats.merge(other.stats)
+        else:
+            self.stats = None
+        trimmed = trim_heavy_hitters(self.value_distribution, self.capacity)
+        self.overflowed = self.overflowed or other.overflowed or trimmed
+
+def new_profile(field, capacity=None, statistics=False):
+    if capacity is None:
+        return FieldProfile(field)
+    return BoundedFieldProfile(field, capacity, statistics)
+
+def profile_rows(headers, rows, capacity=None, statistics=False):
+    """Profile every field in headers with a single pass over rows (dicts
+    like those yielded by csv.DictReader). Returns a list of FieldProfiles
+    (in the order of headers) and the value distributions by field name.
+    If capacity is given, no more than that many distinct values are
+    counted for any field (and, with statistics, ColumnStats are kept for
+    the statistics that can't be worked out from the counts later)."""
+    profiles = [new_profile(field, capacity, statistics) for field in headers]
+    for row in rows:
+        for profile in profiles:
+            profile.update(row[profile.field])
+    return profiles, combine_distributions(profiles)
+
+def profile_column_store(store, headers):
+    """Profile the fields in headers from a ColumnStore (which must hold all
+    of them), which gives exactly what profile_rows would have, but only has
+    to look at each column's distinct values and counts."""
+    profiles = [FieldProfile(field) for field in headers]
+    for profile in profiles:
+        profile.update_counts(store.values(profile.field), store.counts(profile.field))
+    return profiles, combine_distributions(profiles)
+
+def combine_distributions(profiles):
+    # Fields with duplicated names get their counts combined (as they always
+    # have been in the value-distribution report).
+    value_distribution = {}
+    for profile in profiles:
+        if profile.field not in value_distribution:
+            value_distribution[profile.field] = dict(profile.value_distribution)
+        else:
+            for value, count in profile.value_distribution.items():
+                value_distribution[profile.field][value] = value_distribution[profile.field].get(value, 0) + count
+    return value_distribution
+
+# A field as the csv module (with its default dialect) reads it: a quote is
+# only special at the start of a field, which then runs to the closing quote
+# (with doubled quotes inside it), and anything after that (up to the next
+# delimiter) is taken literally, as is a quote in the middle of a field
+# (like the inch mark in 5" pipe).
+csv_field = rb'(?:"[^"]*(?:""[^"]*)*"[^,\r\n]*|[^",\r\n][^,\r\n]*|)'
+csv_record = re.compile(rb'%s(?:,%s)*(?:\r\n|\n|\r)' % (csv_field, csv_field))
+csv_records = re.compile(rb'(?:%s)*' % csv_record.pattern)
+csv_last_record = re.compile(rb'%s(?:,%s)*\Z' % (csv_field, csv_field)) # Without a line ending
+
+def find_chunk_boundaries(csv_file_path, chunk_count, block_size=1 << 20, size=None):
+    """Split a CSV file (or its first size bytes) into (at most) chunk_count
+    byte ranges of about the same size, each of which ends at the end of a
+    record, by reading through the file's records (with the regular
+    expressions above) and taking the end of the record that crosses each
+    target size. Returns the list of boundaries, from 0 to the file size, or
+    None if the file can't be split safely (because it ends inside a quoted
+    field)."""
+    if size is None:
+        size = os.path.getsize(csv_file_path)
+    targets = [size * k // chunk_count for k in range(1, chunk_count)]
+    boundaries = [0]
+    base = 0 # The offset of the start of buffer, which is always the start of a record
+    buffer = b''
+    with ByteRange(csv_file_path, 0, size) as f:
+        while True:
+            block = f.read(block_size)
+            buffer += block
+            # Leave a final \r until the next block, in case it's followed by \n.
+            limit = len(buffer) - 1 if block and buffer.endswith(b'\r') else len(buffer)
+            end = csv_records.match(buffer, 0, limit).end()
+            while len(targets) > 0 and base + end > targets[0]:
+                # Find the end of the record that crosses the target.
+                position = csv_records.match(buffer, 0, targets[0] - base).end()
+                boundary = base + csv_record.match(buffer, position, limit).end()
+                if boundary > boundaries[-1] and boundary < size:
+                    boundaries.append(boundary)
+                targets.pop(0)
+            base += end
+            buffer = buffer[end:]
+            if not block:
+                break
+    if buffer and csv_last_record.match(buffer) is None:
+        return None
+    boundaries.append(size)
+    return boundaries
+
+class ByteRange(io.RawIOBase):
+    """A readable stream of the bytes of a file from start to end."""
+    def __init__(self, path, start, end):
+        self.file = open(path, 'rb')
+        self.file.seek(start)
+        self.remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.remaining <= 0:
+            return 0
+        n = self.file.readinto(memoryview(buffer)[:self.remaining])
+        self.remaining -= n
+        return n
+
+    def tell(self):
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+def open_byte_range(csv_file_path, start, end):
+    # Decode the bytes the same way that open() does.
+    return io.TextIOWrapper(io.BufferedReader(ByteRange(csv_file_path, start, end)))
+
+def profile_byte_range(csv_file_path, start, end, fieldnames, headers, capacity=None, statistics=False, counts_type_tests=False):
+    # Runs in a worker process, so the type-test counts (if they're wanted)
+    # are returned along with the profiles, for the parent to add up.
+    global type_test_counts
+    type_test_counts = new_type_test_counts() if counts_type_tests else None
+    with open_byte_range(csv_file_path, start, end) as csvfile:
+        if start == 0:
+            reader = csv.DictReader(csvfile)
+        else:
+            reader = csv.DictReader(csvfile, fieldnames=fieldnames)
+        profiles, _ = profile_rows(headers, reader, capacity, statistics)
+    return profiles, type_test_counts
+
+def available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError: # Not on Linux
+        return os.cpu_count() or 1
+
+def profile_csv_in_parallel(csv_file_path, fieldnames, headers, workers, capacity=None, statistics=False, size=None):
+    """Profile the fields in headers by splitting the file (or its first size
+    bytes) into byte ranges and profiling each one in a separate process,
+    then merging the results in file order, which gives exactly what
+    profile_rows would have. Returns None if the file can't be split
+    safely."""
+    if workers <= 1: # Not worth scanning for boundaries and pickling profiles for
+        with open_byte_range(csv_file_path, 0, size if size is not None else os.path.getsize(csv_file_path)) as csvfile:
+            return profile_rows(headers, csv.DictReader(csvfile), capacity, statistics)
+    boundaries = find_chunk_boundaries(csv_file_path, workers, size=size)
+    if boundaries is None:
+        return None
+    starts, ends = boundaries[:-1], boundaries[1:]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunk_results = list(executor.map(profile_byte_range, [csv_file_path]*len(starts), starts, ends,
+            [fieldnames]*len(starts), [headers]*len(starts), [capacity]*len(starts), [statistics]*len(starts),
+            [type_test_counts is not None]*len(starts)))
+    chunk_profiles = [profiles for profiles, _ in chunk_results]
+    for _, counts in chunk_results:
+        if counts is not None:
+            add_type_test_counts(counts)
+    profiles = chunk_profiles[0]
+    for later_profiles in chunk_profiles[1:]:
+        for profile, later_profile in zip(profiles, later_profiles):
+            profile.merge(later_profile)
+    return profiles, combine_distributions(profiles)
+
+def arrow_compatible_types(values):
+    """Work out classify(value) for every string in a pyarrow array with
+    vectorized pattern matching, calling classify itself only for the
+    residue that the patterns can't settle (non-ASCII strings, where \\d
+    means more than [0-9], strings with newlines, where $ means more than
+    the end of the string, and datetimes with fractions or time zones).
+    Returns a list of bitmasks."""
+    pc = pyarrow.compute
+    def matches(pattern):
+        return pc.match_substring_regex(values, pattern)
+    def bit(mask, option):
+        return pc.multiply(pc.cast(mask, 'int64'), type_bits[option])
+    int_ok = pc.and_(matches(r'^-?[0-9]+$'), pc.invert(pc.and_(pc.starts_with(values, '0'), pc.not_equal(values, '0'))))
+    float_ok = pc.or_(matches(r'^-?[0-9]*\.[0-9]+$'), matches(r'^-?[0-9]+\.[0-9]*$'))
+    bool_ok = pc.is_in(values, value_set=pyarrow.array(sorted(bool_values)))
+    # Arrow's strptime rolls days like February 30 over into the next month
+    # and allows the year 0, neither of which would survive a round trip
+    # through Python's date type.
+    parsed = pc.strptime(values, format='%Y-%m-%d', unit='s', error_is_null=True)
+    date_ok = pc.fill_null(pc.and_(pc.and_(matches(r'^[0-9]{4}-[0-9]{2}-[0-9]{2}$'), pc.invert(pc.starts_with(values, '0000'))),
+            pc.equal(pc.strftime(parsed, format='%Y-%m-%d'), values)), False)
+    # The same goes for datetimes without fractional seconds or time zones,
+    # the most common kind. (isoformat() would leave off a fraction of zero,
+    # and dateutil has its own ideas about time zones, so those still go to
+    # classify.)
+    datetime_shaped = matches(r'^[0-9]{4}-[0-9]{2}-[0-9]{2}[T ][0-9]{2}:[0-9]{2}:[0-9]{2}$')
+    t_values = pc.replace_substring(values, ' ', 'T', max_replacements=1)
+    parsed = pc.strptime(t_values, format='%Y-%m-%dT%H:%M:%S', unit='s', error_is_null=True)
+    datetime_ok = pc.fill_null(pc.and_(pc.and_(datetime_shaped, pc.invert(pc.starts_with(values, '0000'))),
+            pc.equal(pc.strftime(parsed, format='%Y-%m-%dT%H:%M:%S'), t_values)), False)
+    compatibles = type_bits['text']
+    for mask, option in [(int_ok, 'int'), (float_ok, 'float'), (bool_ok, 'bool'), (date_ok, 'date'), (datetime_ok, 'datetime')]:
+        compatibles = pc.add(compatibles, bit(mask, option))
+    nulls = pc.is_in(values, value_set=pyarrow.array(['', 'NA', 'N/A', 'NULL']))
+    compatibles = pc.if_else(nulls, all_types, compatibles).to_pylist()
+    residue = pc.or_(pc.or_(pc.invert(pc.string_is_ascii(values)), pc.match_substring(values, '\n')),
+            pc.and_(matches(r'^[0-9]{4}-[0-9]{2}-[0-9]{2}[T ]'), pc.invert(datetime_shaped)))
+    for k in pc.indices_nonzero(residue).to_pylist():
+        compatibles[k] = classify(values[k].as_py())
+    return compatibles
+
+def profile_arrow_column(column, profiles):
+    """Count a batch of a column's values (a pyarrow string array) into the
+    profiles of the fields it belongs to (more than one if the field name
+    is repeated), type-testing its distinct values with
+    arrow_compatible_types unless all of them are down to text."""
+    value_counts = pyarrow.compute.value_counts(column) # In order of first appearance
+    values = value_counts.field('values')
+    counts = value_counts.field('counts').to_pylist()
+    compatibles = None
+    if any(profile.candidates != type_bits['text'] for profile in profiles):
+        compatibles = arrow_compatible_types(values)
+    values = values.to_pylist()
+    for profile in profiles:
+        profile.update_counts(values, counts, compatibles)
+
+def profile_csv_with_arrow(csv_file_path, fieldnames, headers, block_size=1 << 24, size=None):
+    """Profile the fields in headers (from the first size bytes of the file,
+    if size is given) with pyarrow's (multithreaded) CSV reader, counting
+    each batch of rows' values with pyarrow and type-testing the distinct
+    ones with arrow_compatible_types. Gives exactly what profile_rows would
+    have. Returns None if pyarrow can't read the file the way csv.DictReader
+    does (for instance, because some rows have the wrong number of fields)."""
+    pc = pyarrow.compute
+    # Arrow's column names are positions, since the real ones may repeat.
+    # Like csv.DictReader, use the last column with a repeated name.
+    position = {field: k for k, field in enumerate(fieldnames)}
+    columns = sorted(set(position[field] for field in headers))
+    names = [f"f{k}" for k in range(len(fieldnames))]
+    read_options = pyarrow.csv.ReadOptions(column_names=names, skip_rows=1, block_size=block_size)
+    parse_options = pyarrow.csv.ParseOptions(newlines_in_values=True)
+    convert_options = pyarrow.csv.ConvertOptions(include_columns=[names[k] for k in columns],
+            column_types={names[k]: pyarrow.string() for k in columns},
+            strings_can_be_null=False, quoted_strings_can_be_null=False)
+    profiles = [FieldProfile(field) for field in headers]
+    try:
+        source = csv_file_path if size is None else pyarrow.BufferReader(pyarrow.memory_map(csv_file_path).read_buffer(size))
+        reader = pyarrow.csv.open_csv(source, read_options=read_options,
+                parse_options=parse_options, convert_options=convert_options)
+        for batch in reader:
+            for k in columns:
+                column = batch.column(names[k])
+                if pc.any(pc.match_substring(column, '\r')).as_py():
+                    # open() translates newlines in quoted values, too.
+                    column = pc.replace_substring_regex(column, '\r\n?', '\n')
+                profile_arrow_column(column, [profile for profile in profiles if position[profile.field] == k])
+    except (pyarrow.ArrowInvalid, UnicodeDecodeError):
+        return None
+    return profiles, combine_distributions(profiles)
+
+columnar_extensions = ['.parquet', '.arrow', '.feather', '.ipc']
+
+def is_columnar_file(path):
+    return os.path.splitext(path)[1].lower() in columnar_extensions
+
+def declared_type(arrow_type):
+    """Return the type that a column's declared Arrow (or Parquet) type
+    corresponds to, or None for strings, whose types have to be inferred
+    from their values."""
+    types = pyarrow.types
+    if types.is_dictionary(arrow_type):
+        return declared_type(arrow_type.value_type)
+    if types.is_string(arrow_type) or types.is_large_string(arrow_type):
+        return None
+    if types.is_boolean(arrow_type):
+        return 'bool'
+    if types.is_integer(arrow_type):
+        return 'int'
+    if types.is_floating(arrow_type) or types.is_decimal(arrow_type):
+        return 'float'
+    if types.is_timestamp(arrow_type):
+        return 'datetime'
+    if types.is_date(arrow_type):
+        return 'date'
+    return 'text' # Binary, times, lists, structs, and so on
+
+def columnar_format(path):
+    # 'parquet', or what the first bytes of a file with one of the other
+    # extensions (which are used loosely) say it is: an Arrow IPC file
+    # ('ipc_file', which is what Feather version 2 is), a Feather version 1
+    # file ('feather_v1'), or else an Arrow IPC stream ('ipc_stream').
+    if os.path.splitext(path)[1].lower() == '.parquet':
+        return 'parquet'
+    with open(path, 'rb') as f:
+        magic = f.read(6)
+    if magic == b'ARROW1':
+        return 'ipc_file'
+    if magic.startswith(b'FEA1'):
+        return 'feather_v1'
+    return 'ipc_stream'
+
+def read_feather_v1(path, columns=None):
+    # Feather version 1 files have no batches to stream, but they aren't
+    # compressed, so memory-mapping the whole table is cheap. (pyarrow warns
+    # that reading them is deprecated, which is no use to whoever has one.)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        return pyarrow.feather.read_table(path, columns=columns, memory_map=True)
+
+def columnar_schema(path):
+    file_format = columnar_format(path)
+    if file_format == 'parquet':
+        return pyarrow.parquet.read_schema(path, memory_map=True)
+    if file_format == 'feather_v1':
+        return read_feather_v1(path).schema
+    with pyarrow.memory_map(path) as source:
+        reader = pyarrow.ipc.open_file(source) if file_format == 'ipc_file' else pyarrow.ipc.open_stream(source)
+        return reader.schema
+
+def columnar_batches(path, columns):
+    """Yield the record batches of a Parquet file, an Arrow IPC file or
+    stream, or a Feather file, memory-mapped and with just the given
+    columns (by position), one row group or IPC batch at a time."""
+    file_format = columnar_format(path)
+    if file_format == 'parquet':
+        parquet_file = pyarrow.parquet.ParquetFile(path, memory_map=True)
+        yield from parquet_file.iter_batches(columns=[parquet_file.schema_arrow.names[k] for k in columns])
+        return
+    if file_format == 'feather_v1':
+        yield from read_feather_v1(path, columns).to_batches()
+        return
+    with pyarrow.memory_map(path) as source:
+        if file_format == 'ipc_file':
+            reader = pyarrow.ipc.open_file(source)
+            batches = (reader.get_batch(k) for k in range(reader.num_record_batches))
+        else:
+            batches = pyarrow.ipc.open_stream(source)
+        for batch in batches:
+            yield pyarrow.RecordBatch.from_arrays([batch.column(j) for j in columns], names=[batch.schema.names[j] for j in columns])
+
+def as_strings(column):
+    # The values as they'd appear in a CSV export, with nulls as ''.
+    if pyarrow.types.is_dictionary(column.type):
+        column = column.dictionary_decode()
+    if not (pyarrow.types.is_string(column.type) or pyarrow.types.is_large_string(column.type)):
+        try:
+            column = pyarrow.compute.cast(column, pyarrow.string())
+        except (pyarrow.ArrowNotImplementedError, pyarrow.ArrowInvalid): # Lists, structs, non-UTF-8 binary, and so on
+            column = pyarrow.array([None if value is None else json.dumps(value, default=str) if isinstance(value, (dict, list))
+                else str(value) for value in column.to_pylist()], pyarrow.string())
+    return pyarrow.compute.fill_null(column, '')
+
+def profile_columnar_file(path, fieldnames, headers):
+    """Profile the fields in headers from a Parquet, Arrow, or Feather file,
+    reading only their columns. Fields with declared types other than
+    strings aren't type-tested at all (only counted); string fields are
+    type-tested as they would be in a CSV file. Returns the profiles, the
+    value distributions, and the declared type of each field (None for
+    strings)."""
+    schema = columnar_schema(path)
+    position = {field: k for k, field in enumerate(fieldnames)} # As with DictReader, the last column of a repeated name
+    columns = sorted(set(position[field] for field in headers))
+    declared_types = {field: declared_type(schema.field(position[field]).type) for field in headers}
+    profiles = [FieldProfile(field) for field in headers]
+    for profile in profiles:
+        if declared_types[profile.field] is not None:
+            profile.candidates = type_bits['text'] # So that only an example value is looked for
+    for batch in columnar_batches(path, columns):
+        for j, k in enumerate(columns):
+            profile_arrow_column(as_strings(batch.column(j)), [profile for profile in profiles if position[profile.field] == k])
+    return profiles, combine_distributions(profiles), declared_types
+
+def columnar_rows(path, fieldnames, columns):
+    """Yield the rows of a Parquet, Arrow, or Feather file as dicts of
+    strings (like csv.DictReader would for a CSV export of it), with just
+    the given columns."""
+    position = {field: k for k, field in enumerate(fieldnames)}
+    positions = sorted(set(position[field] for field in columns))
+    for batch in columnar_batches(path, positions):
+        values = {k: as_strings(batch.column(j)).to_pylist() for j, k in enumerate(positions)}
+        for i in range(batch.num_rows):
+            yield {field: values[position[field]][i] for field in columns}
+
+line_end = re.compile(rb'\r\n?|\n')
+
+def read_line(f):
+    """Read a line from a buffered binary file, ending it at \\r\\n, \\r, or
+    \\n the way open() in text mode does (rather than only at \\n, like
+    f.readline()), and leaving the file just past it."""
+    parts = []
+    while True:
+        chunk = f.peek()
+        if not chunk:
+            break
+        match = line_end.search(chunk)
+        if match is None:
+            parts.append(f.read(len(chunk)))
+            continue
+        parts.append(f.read(match.end()))
+        if match.group() == b'\r' and match.end() == len(chunk) and f.peek()[:1] == b'\n':
+            parts.append(f.read(1)) # The \n of a \r\n split across reads
+        break
+    return b''.join(parts)
+
+def decoded_lines(f):
+    """Yield the lines of a binary file decoded (and with newlines translated)
+    the way that open() in text mode would, but without reading ahead, so
+    that f.tell() stays accurate."""
+    encoding = io.TextIOWrapper(io.BytesIO()).encoding # What open() uses
+    for line in iter(lambda: read_line(f), b''):
+        yield line.decode(encoding, errors='replace').replace('\r\n', '\n').replace('\r', '\n')
+
+# A line that holds a whole record, with every quote either enclosing a
+# field or doubled inside one. (A line that lands inside a quoted field
+# shows up as a quote in the middle of a field, or a quoted field that
+# doesn't end on the line.)
+plain_field = r'(?:"[^"]*(?:""[^"]*)*"|[^",\n]*)'
+plain_record = re.compile(r'%s(?:,%s)*\n?\Z' % (plain_field, plain_field))
+
+def has_line_breaks(values):
+    return any('\n' in value for value in values if isinstance(value, str))
+
+def reservoir_sample(rows, sample_size, rng):
+    """Return sample_size of the rows, chosen uniformly at random in a single
+    pass (or all of them if there are no more than that), in their original
+    order."""
+    reservoir = []
+    for k, row in enumerate(rows):
+        if k < sample_size:
+            reservoir.append((k, row))
+        else:
+            j = rng.randrange(k + 1)
+            if j < sample_size:
+                reservoir[j] = (k, row)
+    return [row for _, row in sorted(reservoir, key=lambda pair: pair[0])]
+
+def sample_rows(csv_file_path, fieldnames, sample_size, seed=0):
+    """Return the first sample_size rows of a CSV file (as dicts, like
+    csv.DictReader yields) plus up to sample_size more rows from random
+    places in the rest of the file, in file order, and whether the whole
+    file had to be read to get them. Rather than reading the whole file,
+    the random rows are found by seeking to random byte offsets and starting
+    at the next line, which is kept only if it's a whole record (see
+    plain_record) with the right number of fields. Since a line can't be
+    told apart from the inside of a quoted field when fields can hold line
+    breaks, a file whose records turn out to have them is reservoir-sampled
+    instead."""
+    rows = []
+    size = os.path.getsize(csv_file_path)
+    rng = random.Random(seed)
+    seen = set()
+    with open(csv_file_path, 'rb') as f:
+        reader = csv.DictReader(decoded_lines(f))
+        for row in reader:
+            rows.append(row)
+            if len(rows) == sample_size:
+                break
+        else:
+            return rows, False # The whole file fits in the sample.
+        head_end = f.tell()
+
+        streams = any(has_line_breaks(row.values()) for row in rows)
+        offsets = sorted(rng.randrange(head_end, size) for _ in range(sample_size)) if not streams else []
+        sampled = []
+        for offset in offsets:
+            f.seek(offset - 1)
+            read_line(f) # Skip the rest of the line that the offset landed in.
+            start = f.tell()
+            if start in seen or start >= size:
+                continue
+            seen.add(start)
+            line = next(decoded_lines(f))
+            try:
+                values = next(csv.reader(itertools.chain([line], decoded_lines(f))))
+            except (csv.Error, StopIteration):
+                continue
+            if has_line_breaks(values):
+                streams = True
+                break
+            if plain_record.match(line) is not None and len(values) == len(fieldnames):
+                sampled.append(dict(zip(fieldnames, values)))
+        if not streams:
+            return rows + sampled, False
+        f.seek(head_end)
+        return rows + reservoir_sample(csv.DictReader(decoded_lines(f), fieldnames=fieldnames), sample_size, rng), True
+
+# Words in a field name that suggest measurements, which may have decimal
+# points even if none turned up in a sample.
+measurement_name = re.compile(r'(?:^|[^a-z])(?:amount|price|cost|fee|rate|ratio|percent|pct|weight|height|length|width|depth|area|distance|temp|temperature|lat|latitude|lon|lng|longitude|avg|average|mean|score)(?:s|es)?(?:$|[^a-z])')
+
+def at_risk_reasons(profile, field_type, minimum_values=30):
+    """Explain why the type chosen for a field from a sample might not hold
+    up for the whole file."""
+    reasons = []
+    non_null_count = profile.row_count - profile.none_count
+    if non_null_count < minimum_values:
+        reasons.append(f"only {non_null_count} non-null values were sampled")
+    if field_type == 'int' and measurement_name.search(profile.field.lower()):
+        reasons.append("int vs. float: the name suggests a measurement, and one value with a decimal point would rule out int")
+    if field_type == 'date' and any(v is not None and len(v) > 10 for v in profile.value_distribution):
+        reasons.append("date vs. datetime: all the sampled times are midnight")
+    if field_type == 'bool' and set(profile.value_distribution) - {None, '', 'NA', 'N/A', 'NULL'} <= {'0', '1'}:
+        reasons.append("bool vs. int: only 0s and 1s were sampled")
+    return reasons
+
+def confirm_types(csv_file_path, profiles):
+    """Read the whole file, checking only that every value is compatible with
+    the type that the (sampled) profile of its field settled on. A field
+    stops being checked at its first violation. Returns a dict mapping
+    fields to descriptions of their violations."""
+    checks = {} # The type to check (before any name-based overrides) for each field
+    sampled_date_types = {}
+    for profile in profiles:
+        selection = most_stringent_type(profile.type_candidates())
+        if profile.value_example is None:
+            checks[profile.field] = None # Look for any value at all.
+        elif selection != 'text':
+            checks[profile.field] = selection
+            sampled_date_types[profile.field] = profile.date_type()
+    violations = {}
+    with open(csv_file_path) as csvfile:
+        reader = csv.DictReader(csvfile)
+        for row_number, row in enumerate(reader, 1):
+            if not checks:
+                break # Everything has been ruled out.
+            for field, selection in list(checks.items()):
+                value = row[field]
+                if value in [None, '', 'NA', 'N/A', 'NULL']:
+                    continue
+                if selection is None:
+                    violations[field] = f"the value {value!r} (row {row_number}) shows that the field is not empty"
+                elif not classify(value) & type_bits[selection]:
+                    violations[field] = f"the value {value!r} (row {row_number}) is not of type {selection}"
+                elif selection in ['date', 'datetime'] and len(value) > 10:
+                    dt = parse_datetime(value)
+                    if not(dt.hour == dt.minute == dt.second == 0) and sampled_date_types[field] == 'date':
+                        violations[field] = f"the value {value!r} (row {row_number}) has a time of day, so the field is a datetime"
+                    else:
+                        continue
+                else:
+                    continue
+                del checks[field]
+    return violations
+
+def profile_state_path(csv_file_path):
+    return re.sub(r"\.csv", "-profile-state.pickle", csv_file_path)
+
+def prefix_checksum(csv_file_path, offset, block_size=1 << 20):
+    # The first and last blocks of the part of the file that was profiled,
+    # which is enough to notice a file being replaced or rewritten without
+    # having to read all of it again.
+    with open(csv_file_path, 'rb') as f:
+        head = f.read(min(block_size, offset))
+        f.seek(max(0, offset - block_size))
+        tail = f.read(offset - max(0, offset - block_size))
+    return blake2b(head + tail).hexdigest()
+
+def save_profile_state(csv_file_path, fieldnames, capacity, offset, profiles):
+    """Save the profiles of the first offset bytes of a CSV file next to it,
+    so that a later run can pick up where this one left off if rows are
+    appended to the file. Returns False if offset isn't at the end of a line
+    (where it would be unsafe to resume)."""
+    with open(csv_file_path, 'rb') as f:
+        f.seek(max(0, offset - 1))
+        if offset == 0 or f.read(1) != b'\n':
+            return False
+    state = {'fieldnames': list(fieldnames), 'capacity': capacity, 'offset': offset,
+            'checksum': prefix_checksum(csv_file_path, offset), 'profiles': profiles}
+    with open(profile_state_path(csv_file_path), 'wb') as f:
+        pickle.dump(state, f)
+    return True
+
+# The only globals that a saved profile state refers to. The classes
+# defined here are pickled under __main__ when this is run as a script.
+profile_state_classes = ['FieldProfile', 'BoundedFieldProfile', 'ColumnStats']
+profile_state_globals = {('sketches', 'HyperLogLog'), ('sketches', 'QuantileSketch'),
+    ('collections', 'defaultdict'), ('collections', 'OrderedDict'),
+    ('builtins', 'int'), ('builtins', 'float'), ('builtins', 'bytearray'), ('builtins', 'set'), ('builtins', 'frozenset'),
+    ('datetime', 'datetime'), ('datetime', 'date'), ('datetime', 'timedelta'), ('datetime', 'timezone')}
+
+class ProfileStateUnpickler(pickle.Unpickler):
+    """An unpickler that refuses anything but the classes a profile state is
+    made of, so that whoever can write to the directory holding a CSV file
+    can't get code run by planting a state file next to it."""
+    def find_class(self, module, name):
+        if module in ['__main__', 'lil_lex'] and name in profile_state_classes:
+            return globals()[name]
+        if (module, name) in profile_state_globals:
+            return super().find_class(module, name)
+        raise pickle.UnpicklingError(f"{module}.{name} isn't part of a profile state")
+
+def load_profile_state(csv_file_path, fieldnames, capacity, statistics=False):
+    """Load the state saved by save_profile_state, if there is any and the
+    part of the file that it describes is unchanged (and, if statistics are
+    wanted, has them). Otherwise return None."""
+    try:
+        with open(profile_state_path(csv_file_path), 'rb') as f:
+            state = ProfileStateUnpickler(f).load()
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        return None
+    if not isinstance(state, dict) or state.keys() != {'fieldnames', 'capacity', 'offset', 'checksum', 'profiles'}:
+        return None
+    if state['fieldnames'] != list(fieldnames) or state['capacity'] != capacity:
+        return None
+    if capacity is not None and statistics and any(getattr(profile, 'stats', None) is None for profile in state['profiles']):
+        return None
+    if os.path.getsize(csv_file_path) < state['offset']:
+        return None
+    if prefix_checksum(csv_file_path, state['offset']) != state['checksum']:
+        return None
+    return state
+
+def profile_new_rows(csv_file_path, state, headers, end):
+    """Profile the rows between the saved offset and end (so that rows
+    appended during the run are left for the next one) and merge them into
+    the saved profiles, which gives exactly what profiling the whole file
+    would have."""
+    profiles = state['profiles']
+    with open_byte_range(csv_file_path, state['offset'], end) as csvfile:
+        reader = csv.DictReader(csvfile, fieldnames=state['fieldnames'])
+        statistics = state['capacity'] is not None and all(getattr(profile, 'stats', None) is not None for profile in profiles)
+        new_profiles, _ = profile_rows(headers, reader, state['capacity'], statistics)
+    for profile, new_profile in zip(profiles, new_profiles):
+        profile.merge(new_profile)
+    return profiles, combine_distributions(profiles)
+
+def column_selector(include=None, exclude=None):
+    """Return a function that says whether a column should be profiled: if
+    include is given, it has to match one of its patterns, and it can't
+    match any of exclude's. A pattern like /^tax_/ is a regular expression
+    (which only has to match part of the name); anything else has to be
+    the whole name."""
+    def matches(field, patterns):
+        for pattern in patterns:
+            if len(pattern) > 1 and pattern.startswith('/') and pattern.endswith('/'):
+                if re.search(pattern[1:-1], field) is not None:
+                    return True
+            elif field == pattern:
+                return True
+        return False
+    def selected(field):
+        return (include is None or matches(field, include)) and not (exclude is not None and matches(field, exclude))
+    return selected
+
+def projected_rows(reader, fieldnames, columns):
+    """Turn the lists of values that csv.reader yields into dicts of just
+    the given columns, as csv.DictReader would have made them (skipping
+    blank lines, using the last of any columns with the same name, and
+    filling in None for missing values), without making a dict entry for
+    every other column."""
+    position = {field: k for k, field in enumerate(fieldnames)}
+    positions = [position[field] for field in columns]
+    width = len(fieldnames)
+    for row in reader:
+        if row == []:
+            continue
+        if len(row) >= width:
+            yield {field: row[k] for field, k in zip(columns, positions)}
+        else:
+            yield {field: row[k] if k < len(row) else None for field, k in zip(columns, positions)}
+
 def dump_to_format(field, maintain_case=False):
     field = convert_dots(eliminate_BOM(field))
     return eliminate_extra_underscores(snake_case(field, maintain_case))
@@ -231,149 +1287,604 @@ def args(field: str, nones: int, maintain_case: bool) -> Tuple[str, str]:
         arg_list.append('allow_none=True')
     return ', '.join(arg_list), dump_to
 
+class Profiler:
+    """Profiles a table and returns the results as plain data (dicts and
+    lists), without printing anything, so that many tables can be profiled
+    in one process. The options are the same as lil_lex.py's command-line
+    options, though sample_size, confirm, resume, workers > 1, and
+    backend='arrow' need the table to be given as the path of a plain .csv
+    file (not a compressed one, or one in a zip archive). Parquet, Arrow,
+    and Feather files (given as paths) are profiled by
+    profile_columnar_file, without those options or capacity. With
+    statistics, each field also gets the statistics from its ColumnStats.
+    include and exclude (lists of column names and /regular expressions/)
+    limit the profiling to some of the columns; see column_selector."""
+    def __init__(self, maintain_case=False, no_integers=False, workers=1, sample_size=None, confirm=False,
+            capacity=None, max_key_size=None, backend='python', resume=False, statistics=False,
+            include=None, exclude=None):
+        self.maintain_case = maintain_case
+        self.no_integers = no_integers
+        self.workers = workers
+        self.sample_size = sample_size
+        self.confirm = confirm
+        self.capacity = capacity
+        self.max_key_size = max_key_size
+        self.backend = backend
+        self.resume = resume
+        self.statistics = statistics
+        self.include = include
+        self.exclude = exclude
+
+    def profile(self, source, fieldnames=None, run_profiler=None):
+        """Profile source, which can be the path of a CSV file (or anything
+        else that csv_input.open_csv can open), an open CSV file, or an
+        iterable of rows (dicts like those yielded by csv.DictReader, with
+        fieldnames giving the order of the fields if the first row's keys
+        don't). Returns a dict of the results: the headers, a dict for each
+        field (with its type, type candidates, example, none count,
+        uniqueness, NA flag, distribution summary, and warnings), the empty,
+        single-value, and potential primary key fields, composite keys (if
+        max_key_size was given), the Marshmallow schema fields, and notes
+        about how the table was profiled. If a RunProfiler is given, the
+        profiling phases are timed, and progress through the rows is
+        reported on stderr."""
+        run_profiler = run_profiler or RunProfiler()
+        notes = []
+        csv_file_path = None
+        streams = False # Whether the file has to be read from start to finish (see csv_input.py)
+        if isinstance(source, (str, os.PathLike)):
+            csv_file_path = os.fspath(source)
+            streams = needs_streaming(csv_file_path) and not is_columnar_file(csv_file_path)
+        if (csv_file_path is None or streams) and (self.sample_size is not None or self.resume or self.workers > 1 or self.backend != 'python'
+                or (self.max_key_size is not None and self.capacity is not None)):
+            raise ValueError("These options need the table to be given as the path of a plain CSV file.")
+
+        columnar = csv_file_path is not None and is_columnar_file(csv_file_path)
+        if columnar and (self.sample_size is not None or self.resume or self.workers > 1 or self.backend != 'python'
+                or self.capacity is not None):
+            raise ValueError("sample_size, resume, workers, backend, and capacity can't be used with Parquet, Arrow, or Feather files.")
+
+        file_size = os.path.getsize(csv_file_path) if csv_file_path is not None and not streams else None # How far this run will profile
+        resumes = self.resume and self.sample_size is None
+        end = file_size if resumes else None # So that rows appended during the run are left for the next one
+
+        selects_columns = self.include is not None or self.exclude is not None
+        declared_types = {} # The types of the fields whose columns have declared types other than strings
+        with contextlib.ExitStack() as stack:
+            list_reader = None # For reading just the selected columns
+            if columnar:
+                fieldnames = columnar_schema(csv_file_path).names
+                rows = None
+            elif csv_file_path is not None or hasattr(source, 'read'):
+                if csv_file_path is None:
+                    csvfile = source
+                elif resumes:
+                    csvfile = stack.enter_context(open_byte_range(csv_file_path, 0, file_size))
+                else:
+                    csvfile = stack.enter_context(open_csv(csv_file_path))
+                if selects_columns:
+                    list_reader = csv.reader(csvfile)
+                    fieldnames = next(list_reader)
+                else:
+                    rows = csv.DictReader(csvfile)
+                    fieldnames = rows.fieldnames
+            else:
+                rows = iter(source)
+                if fieldnames is None:
+                    first_row = next(rows, None)
+                    fieldnames = [] if first_row is None else list(first_row)
+                    rows = rows if first_row is None else itertools.chain([first_row], rows)
+            headers = list(fieldnames)
+            # Remove the _id field added by CKAN, if it's there.
+            if '_id' in headers:
+                headers.remove('_id')
+            columns = headers # All of them, including any that won't be profiled
+            unselected_columns = []
+            if selects_columns:
+                selected = column_selector(self.include, self.exclude)
+                headers = [field for field in columns if selected(field)]
+                unselected_columns = [field for field in columns if not selected(field)]
+                notes.append(f"Profiling {len(headers)} of the {len(columns)} columns.")
+                if list_reader is not None:
+                    rows = projected_rows(list_reader, fieldnames, headers)
+            if file_size is not None and not columnar and run_profiler.reports_progress:
+                rows = run_profiler.track(rows, csvfile.buffer, file_size)
+
+            results = None
+            store = None
+            state = None
+            if csv_file_path is not None and resumes:
+                state = load_profile_state(csv_file_path, fieldnames, self.capacity, self.statistics)
+                if state is None:
+                    notes.append(f"There's no saved profile state for {csv_file_path} that still matches it, so the whole file will be profiled.")
+            if state is not None and [profile.field for profile in state['profiles']] != headers:
+                notes.append(f"The profile state saved for {csv_file_path} is for other columns, so the whole file will be profiled.")
+                state = None
+            if columnar:
+                # Read only the columns being profiled, and take the declared
+                # types as given (leaving just string columns to type-test).
+                profiles, value_distribution, declared_types = profile_columnar_file(csv_file_path, fieldnames, headers)
+                results = profiles, value_distribution
+            elif state is not None:
+                notes.append(f"Resuming from the profile state saved at byte {state['offset']} of {file_size}.")
+                results = profile_new_rows(csv_file_path, state, headers, file_size)
+            elif (self.max_key_size is not None and self.sample_size is None and self.capacity is None and not columnar
+                    and self.backend == 'python' and self.workers == 1):
+                # The search for composite keys needs every row, so load
+                # the columns into memory once and profile them from there.
+                # (With backend=arrow or workers=, the file is profiled that
+                # way instead, and just the key columns are read afterward.)
+                store = ColumnStore(headers).add_rows(rows)
+                results = profile_column_store(store, headers)
+            elif self.sample_size is not None:
+                rows, streamed = sample_rows(csv_file_path, fieldnames, self.sample_size)
+                notes.append(f"Profiling a sample of {len(rows)} rows.")
+                if streamed:
+                    notes.append(f"{csv_file_path} has line breaks inside quoted fields, so the sample was drawn by reading through the whole file.")
+                results = profile_rows(headers, rows, self.capacity, self.statistics)
+            elif self.backend == 'arrow':
+                if pyarrow is None:
+                    notes.append("backend=arrow needs pyarrow (pip install pyarrow), so the file will be profiled without it.")
+                elif self.capacity is not None:
+                    notes.append("backend=arrow can't be combined with budget=, so the file will be profiled without it.")
+                else:
+                    results = profile_csv_with_arrow(csv_file_path, fieldnames, headers, size=end)
+                    if results is None:
+                        notes.append(f"pyarrow can't read {csv_file_path} the way the csv module does (maybe some rows have the wrong number of fields), so it will be profiled without it.")
+            elif self.workers > 1 and available_cpus() == 1:
+                notes.append("Only one CPU is available, so the file will be profiled in a single process (workers= would just add overhead).")
+            elif self.workers > 1:
+                # More workers than CPUs would only mean more overhead.
+                results = profile_csv_in_parallel(csv_file_path, fieldnames, headers, min(self.workers, available_cpus()),
+                        self.capacity, self.statistics, end)
+                if results is None:
+                    notes.append(f"Unable to split {csv_file_path} safely (it ends inside a quoted field), so it will be profiled in a single process.")
+            if results is None:
+                # Stream through the rows once, rather than holding them all in memory.
+                results = profile_rows(headers, rows, self.capacity, self.statistics)
+            profiles, value_distribution = results
+            if resumes:
+                if save_profile_state(csv_file_path, fieldnames, self.capacity, file_size, profiles):
+                    notes.append(f"Saved the profile state to {profile_state_path(csv_file_path)}.")
+                else:
+                    notes.append(f"{csv_file_path} doesn't end with a complete line, so the profile state wasn't saved.")
+            run_profiler.end_profile_phase()
+
+        fields = []
+        parameters = defaultdict(lambda: defaultdict(bool))
+        fix_nas = defaultdict(lambda: False)
+        estimated_distinct_counts = {} # For fields with too many distinct values to count within the budget
+        for profile in profiles:
+            field = profile.field
+            if declared_types.get(field) is not None:
+                type_candidates = list(dict.fromkeys(['text', declared_types[field]])) # As the values would test
+                inferred_type = declared_types[field]
+            else:
+                type_candidates = profile.type_candidates()
+                inferred_type = choose_type(type_candidates, profile.field_values(), field, profile.date_type())
+            field_type = inferred_type
+            if profile.has_nas():
+                fix_nas[field] = True
+            parameters['unique'][field] = profile.is_unique()
+            if profile.is_estimate():
+                estimated_distinct_counts[field] = profile.distinct_count()
+            if profile.value_example is None:
+                parameters['empty'][field] = True # Defaults to False because of the defaultdict.
+                field_type = 'text' # Override any other field_type and use text when no value was found.
+            fields.append({'column': field, 'type': field_type, 'inferred_type': inferred_type,
+                'type_candidates': type_candidates, 'example': profile.value_example,
+                'none_count': profile.none_count, 'unique': profile.is_unique(), 'estimated': profile.is_estimate(),
+                'has_nas': profile.has_nas(), 'warnings': profile.warnings})
+            if self.statistics:
+                fields[-1]['statistics'] = profile.statistics(field_type).summary(field_type)
+        if self.statistics and self.sample_size is not None:
+            notes.append("The field statistics are for the sampled rows only.")
+        run_profiler.end_phase('type selection')
+
+        distributions = []
+        single_value_fields = {}
+        for field, dist in value_distribution.items():
+            summary = {'field': field, 'distinct_count': len(dist), 'estimated': field in estimated_distinct_counts,
+                    'values': None, 'most_common': None}
+            if field in estimated_distinct_counts:
+                summary['distinct_count'] = estimated_distinct_counts[field]
+            elif len(dist) == 1:
+                value = list(dist.keys())[0]
+                if value not in [None, '', 'NA', 'NULL']:
+                    single_value_fields[field] = value
+            if len(dist) <= 5 and field not in estimated_distinct_counts:
+                summary['values'] = dict(dist)
+            elif len(dist) > 0:
+                max_key = max(dist, key=dist.get)
+                summary['most_common'] = (max_key, dist[max_key])
+            distributions.append(summary)
+        summaries = {summary['field']: summary for summary in distributions}
+        for field_result in fields:
+            field_result['distribution'] = summaries[field_result['column']]
+
+        composite_keys = None
+        if self.max_key_size is not None:
+            # Empty, single-value, and unique fields can't be part of a
+            # minimal composite key.
+            key_columns = [profile.field for profile in profiles if not parameters['empty'][profile.field]
+                    and not parameters['unique'][profile.field] and profile.distinct_count() > 1]
+            key_columns = list(dict.fromkeys(key_columns)) # Deduplicate
+            if store is None and columnar:
+                store = ColumnStore(key_columns).add_rows(columnar_rows(csv_file_path, fieldnames, key_columns))
+            elif store is None:
+                with open_csv(csv_file_path) as csvfile:
+                    store = ColumnStore(key_columns).add_rows(csv.DictReader(csvfile))
+            codes = {column: store.codes[column] for column in key_columns}
+            composite_keys = find_composite_keys(codes, store.cardinalities(), store.row_count, self.max_key_size)
+            run_profiler.end_phase('composite keys')
+
+        at_risk, violations = None, None
+        if self.sample_size is not None:
+            at_risk = []
+            for profile, field_result in zip(profiles, fields):
+                reasons = at_risk_reasons(profile, field_result['type'])
+                if len(reasons) > 0:
+                    at_risk.append({'column': profile.field, 'type': field_result['type'], 'reasons': reasons})
+            if self.confirm:
+                violations = confirm_types(csv_file_path, profiles)
+            run_profiler.end_phase('sample report')
+
+        return {'csv_file_path': csv_file_path,
+                'headers': list(fieldnames),
+                'columns': columns,
+                'unselected_columns': unselected_columns,
+                'notes': notes,
+                'fields': fields,
+                'distributions': distributions,
+                'empty_fields': [field for field in parameters['empty'] if parameters['empty'][field]],
+                'single_value_fields': single_value_fields,
+                'potential_primary_key_fields': [field for field in parameters['unique'] if parameters['unique'][field] and field not in estimated_distinct_counts],
+                'estimated_potential_primary_key_fields': [field for field in parameters['unique'] if parameters['unique'][field] and field in estimated_distinct_counts],
+                'composite_keys': composite_keys,
+                'at_risk': at_risk,
+                'violations': violations,
+                'schema': self.schema(fields, fix_nas),
+                'row_count': profiles[0].row_count if len(profiles) > 0 else 0}
+
+    def schema(self, fields, fix_nas):
+        # The Marshmallow field definitions, up to the first dump_to name
+        # that conflicts with an earlier one (if there is one).
+        schema_type = types_no_integers if self.no_integers else base_schema_type
+        schema_fields, dump_tos, error = [], [], None
+        for field_result in fields:
+            field = field_result['column']
+            arg_string, dump_to = args(field, field_result['none_count'], self.maintain_case)
+            schema_fields.append(f"{convert_dots(eliminate_BOM(snake_case(field)))} = fields.{schema_type[field_result['type']]}({arg_string})")
+            if dump_to in dump_tos:
+                error = "That list dump_to name conflicts with one that's already in the schema!"
+                break
+            dump_tos.append(dump_to)
+        return {'fields': schema_fields, 'error': error, 'coerce_integers': self.no_integers,
+                'fields_with_nas': [intermediate_format(field) for field, has_na in fix_nas.items() if has_na]}
+
+def compare_with_datastore(fields, datastore_fields):
+    """Pair each field's type with the type of the datastore column it came
+    from."""
+    datastore_type = {field['id']: field['type'] for field in datastore_fields}
+    return [{'column': field_result['column'], 'type': field_result['type'], 'datastore_type': datastore_type[field_result['column']],
+        'matches': datastore_types.get(datastore_type[field_result['column']]) == field_result['type']}
+        for field_result in fields if field_result['column'] in datastore_type]
+
+def describe_statistics(statistics):
+    if statistics['min_length'] is None:
+        return "no values"
+    parts = []
+    if 'mean' in statistics:
+        parts.append(f"{statistics['min']} to {statistics['max']}, mean {statistics['mean']}"
+                + (f", standard deviation {statistics['std']}" if statistics['std'] is not None else "")
+                + f", quartiles {' / '.join(statistics['quartiles'])}" + (" (estimated)" if statistics['quartiles_estimated'] else ""))
+    if 'earliest' in statistics:
+        parts.append(f"{statistics['earliest']} to {statistics['latest']}")
+    parts.append(f"lengths {statistics['min_length']} to {statistics['max_length']}")
+    return '; '.join(parts)
+
+def print_report(result):
+    """Print the report on a table (which lil_lex.py prints before writing the
+    data dictionary) from the results of Profiler.profile."""
+    print(result['headers'])
+    for note in result['notes']:
+        print(note)
+    for field_result in result['fields']:
+        field = field_result['column']
+        for warning in field_result['warnings']:
+            print(warning)
+        unique = field_result['unique']
+        print("{} {} {} {}".format(field, field_result['inferred_type'], field_result['type_candidates'], ("   ALL UNIQUE" if unique else "    ") + (" (estimated)" if field_result['estimated'] and unique else "")))
+        if field_result['inferred_type'] is None:
+            print("No values found for the field {field}.")
+        if field_result['example'] is None:
+            print("values: No values found for the field {field}.")
+
+    print(f"#### VALUE DISTRIBUTION BY FIELD ####")
+    for summary in result['distributions']:
+        field = summary['field']
+        if summary['estimated']:
+            if summary['most_common'] is None:
+                print(f"{field}: about {summary['distinct_count']} values, none of them common (estimated)")
+            else:
+                max_key, count = summary['most_common']
+                print(f"{field}: {max_key} (at least {count} rows) + about {summary['distinct_count'] - 1} other values (estimated)")
+        elif summary['values'] is not None:
+            if summary['distinct_count'] > 0: # Otherwise there were no rows.
+                print(f"{field}: {summary['values']} {'<============================' if summary['distinct_count'] < 2 else ''}")
+        else:
+            max_key, count = summary['most_common']
+            print(f"{field}: {max_key} ({count} rows) + {summary['distinct_count'] - 1} other values")
+
+    print("\n\nEMPTY FIELDS: {}".format(result['empty_fields']))
+    print(f"SINGLE-VALUE FIELDS: {result['single_value_fields']}")
+    print("POTENTIAL PRIMARY KEY FIELDS: {}".format(result['potential_primary_key_fields']))
+    if any(summary['estimated'] for summary in result['distributions']):
+        print("POTENTIAL PRIMARY KEY FIELDS (estimated): {}".format(result['estimated_potential_primary_key_fields']))
+    if result['composite_keys'] is not None:
+        print(f"POTENTIAL COMPOSITE PRIMARY KEYS: {result['composite_keys']}")
+
+    if any('statistics' in field_result for field_result in result['fields']):
+        print(f"\n#### FIELD STATISTICS ####")
+        for field_result in result['fields']:
+            print(f"{field_result['column']}: {describe_statistics(field_result['statistics'])}")
+
+    if result['at_risk'] is not None:
+        print(f"\n#### FIELDS WHOSE TYPES MIGHT NOT HOLD FOR THE WHOLE FILE ####")
+        for risk in result['at_risk']:
+            print(f"{risk['column']} ({risk['type']}): {'; '.join(risk['reasons'])}")
+        if result['violations'] is not None:
+            if len(result['violations']) == 0:
+                print("\nThe whole file was checked, and every field's values are consistent with the sampled types.")
+            else:
+                print("\nThe whole file was checked, and these sampled types are WRONG (run without sample= to get the right ones):")
+                for field, violation in result['violations'].items():
+                    print(f"  {field}: {violation}")
+
+    if result.get('datastore_comparison') is not None:
+        print(f"\n#### INFERRED TYPES VS. THE DATASTORE'S ####")
+        mismatches = [comparison for comparison in result['datastore_comparison'] if not comparison['matches']]
+        for comparison in mismatches:
+            print(f"{comparison['column']}: inferred {comparison['type']}, but the datastore has {comparison['datastore_type']}")
+        if len(mismatches) == 0:
+            print("Every field's inferred type matches its type in the datastore.")
+
+def write_data_dictionary(result, data_dictionary_path, statistics_columns=False):
+    # With statistics_columns, the field statistics (which need
+    # Profiler(statistics=True)) are added as extra columns.
+    list_of_dicts = []
+    field_results = iter(result['fields'])
+    unselected_columns = set(result.get('unselected_columns', []))
+    for column in result.get('columns', [field_result['column'] for field_result in result['fields']]):
+        if column in unselected_columns: # Passed through without being profiled
+            tuples = [('column', column), ('type', ''), ('label', ''), ('description', ''), ('example', '')]
+            if statistics_columns:
+                tuples += [(name, '') for name in ['min', 'max', 'mean', 'std', 'median', 'min_length', 'max_length']]
+            list_of_dicts.append(OrderedDict(tuples))
+            continue
+        field_result = next(field_results)
+        tuples = [('column', field_result['column']),
+                ('type', field_result['type']),
+                ('label',''),
+                ('description',''),
+                ('example',field_result['example'])]
+        if statistics_columns:
+            statistics = field_result['statistics']
+            tuples += [('min', statistics.get('min', statistics.get('earliest'))),
+                    ('max', statistics.get('max', statistics.get('latest'))),
+                    ('mean', statistics.get('mean')),
+                    ('std', statistics.get('std')),
+                    ('median', statistics['quartiles'][1] if 'quartiles' in statistics else None),
+                    ('min_length', statistics['min_length']),
+                    ('max_length', statistics['max_length'])]
+
+        list_of_dicts.append(OrderedDict(tuples))
+    row1 = list_of_dicts[0]
+    data_dictionary_fields = [tup for tup in row1]
+    with open(data_dictionary_path, 'w') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=data_dictionary_fields)
+        writer.writeheader()
+        writer.writerows(list_of_dicts)
+
+def print_schema(result):
+    ### ETL Wizard functionality: Generate Marshamallow schema for ETL jobs
+    print("\n\n *** *** ** *  *   * ** *      * ** ***** * *   *")
+    schema = result['schema']
+    if schema['coerce_integers']: # Lots of fields are coded as integers, but we want to switch them
+        # to strings because they are just ID numbers that one should not do math with (like ward IDs).
+        print("Coercing all integer fields to strings, since so many such fields are not actual counts.")
+
+    for s in schema['fields']:
+        print(pprint.pformat(s, width=999).strip('"'))
+    if schema['error'] is not None:
+        raise ValueError(schema['error'])
+
+    tab = " "*4
+    print(f"\nclass Meta:\n{tab}ordered = True\n")
+    fields_with_nas = [f"'{field}'" for field in schema['fields_with_nas']]
+    print(f"@pre_load\ndef fix_nas(self, data):\n{tab}fields_with_nas = [{', '.join(fields_with_nas)}]\n{tab}for f in fields_with_nas:\n{tab*2}if data[f] in ['NA', 'NULL']:\n{tab*3}data[f] = None\n")
+
+    # [ ] Detect field names that need to be put in load_from arguments.
+        # * Sense whether Marshmallow can convert source field name to snake_case name (exceptions?)
+
+def profile_csv_file(csv_file_path, maintain_case=False, no_integers=False, analyze_only=False, workers=1,
+        sample_size=None, confirm=False, capacity=None, max_key_size=None, backend='python', resume=False,
+        profile_run=False, run_profile_path=None, page_size=10000, prefetch=2, statistics=False, statistics_columns=False,
+        include=None, exclude=None):
+    """Profile a CSV file, print the report, and (unless analyze_only) write
+    the data dictionary and print the Marshmallow schema, as lil_lex.py does
+    from the command line. Returns the results from Profiler.profile (or
+    None if the file can't be handled). If profile_run, the time taken by
+    each phase and other statistics of the run are written as JSON to
+    run_profile_path (by default, next to the CSV file), and progress is
+    reported on stderr.
+
+    csv_file_path can also be 'resource=<CKAN resource ID>', to profile a
+    datastore table (on the site in credentials.py) by paging through its
+    records (page_size at a time, with prefetch pages fetched ahead) and
+    compare the inferred types with the datastore's. The data dictionary is
+    then written to <resource ID>-data-dictionary.csv. The options that need
+    a plain .csv file (see below) can't be used with a datastore table.
+
+    Compressed files (.gz, .bz2, or .xz), zip archives (archive.zip if it
+    holds one CSV file, or archive.zip:member.csv), and stdin (-) are read
+    as streams, with the outputs named after the CSV file inside (so the
+    data dictionary of data.csv.gz is data-data-dictionary.csv). Options
+    that have to seek through the file (workers=, sample=, resume, and
+    backend=arrow) need a plain .csv file.
+
+    Parquet, Arrow IPC, and Feather files (.parquet, .arrow, .feather, or
+    .ipc) are read with pyarrow, memory-mapped and only for the columns
+    being profiled. Columns with declared types other than strings get the
+    corresponding types without their values being tested; string columns
+    are type-tested as if they were in a CSV file. workers=, sample=,
+    resume, backend=, and budget= can't be used with them.
+
+    With statistics, the report includes statistics for each field (ranges,
+    means, quartiles, lengths, and date spans), and with statistics_columns,
+    they're also added to the data dictionary as extra columns.
+
+    include and exclude (lists of column names and /regular expressions/)
+    pick the columns to profile; the others are listed in the data
+    dictionary without types."""
+    global type_test_counts
+    resource_id = None
+    if csv_file_path.startswith('resource='):
+        resource_id = csv_file_path.split('=', 1)[1]
+        if workers > 1 or sample_size is not None or resume or backend != 'python' or (max_key_size is not None and capacity is not None):
+            print("workers=, sample=, resume, backend=arrow, and keys with budget= need a plain .csv file, so they can't be used with a datastore table.")
+            return None
+        output_path = f"{resource_id}.csv" # The outputs are named as if the table were a CSV file.
+    elif is_columnar_file(csv_file_path):
+        if pyarrow is None:
+            print(f"Reading {csv_file_path} needs pyarrow (pip install pyarrow).")
+            return None
+        if workers > 1 or sample_size is not None or resume or backend != 'python' or capacity is not None:
+            print(f"workers=, sample=, resume, backend=, and budget= can't be used with {csv_file_path}.")
+            return None
+        output_path = f"{os.path.splitext(csv_file_path)[0]}.csv"
+    elif not is_csv_input(csv_file_path):
+        print('This whole fragile thing falls apart if the file name does not end in ".csv" (or ".gz", ".bz2", ".xz", ".zip", ".parquet", ".arrow", ".feather", or ".ipc"). Sorry.')
+        return None
+    else:
+        if needs_streaming(csv_file_path) and (workers > 1 or sample_size is not None or resume or backend != 'python'
+                or (max_key_size is not None and capacity is not None)):
+            print(f"workers=, sample=, resume, backend=arrow, and keys with budget= need a plain .csv file, so they can't be used with {csv_file_path}.")
+            return None
+        output_path = output_csv_path(csv_file_path)
+    run_profiler = RunProfiler(reports_progress=profile_run)
+    if profile_run:
+        if run_profile_path is None:
+            run_profile_path = re.sub(r"\.csv", "-run-profile.json", output_path)
+        type_test_counts = new_type_test_counts()
+    profiler = Profiler(maintain_case, no_integers, workers, sample_size, confirm, capacity, max_key_size, backend, resume,
+        statistics or statistics_columns, include, exclude)
+    if resource_id is not None:
+        from credentials import site, API_key # Use sample-credentials.py as a model for creating this file.
+        from data_dictionary_util import datastore_records
+        datastore_fields, records = datastore_records(site, resource_id, API_key, page_size, prefetch)
+        result = profiler.profile(records, [field['id'] for field in datastore_fields], run_profiler)
+        result['datastore_comparison'] = compare_with_datastore(result['fields'], datastore_fields)
+    elif is_columnar_file(csv_file_path):
+        try:
+            result = profiler.profile(csv_file_path, run_profiler=run_profiler)
+        except pyarrow.ArrowInvalid as error:
+            print(f"pyarrow can't read {csv_file_path} as a Parquet, Arrow, or Feather file: {error}")
+            return None
+    else:
+        result = profiler.profile(csv_file_path, run_profiler=run_profiler)
+    print_report(result)
+    run_profiler.end_phase('report')
+
+    result['data_dictionary_path'] = None
+    if not analyze_only:
+        result['data_dictionary_path'] = re.sub(r"\.csv", "-data-dictionary.csv", output_path)
+        write_data_dictionary(result, result['data_dictionary_path'], statistics_columns)
+        run_profiler.end_phase('dictionary write')
+        print_schema(result)
+        run_profiler.end_phase('schema')
+
+    if profile_run:
+        run_profile = run_profiler.summary(result['row_count'],
+            {'type_tests': {option: dict(counts, hit_rate=counts['passed']/counts['tested'] if counts['tested'] > 0 else None)
+                for option, counts in type_test_counts.items()},
+            'classify_cache': classify.cache_info()._asdict(),
+            'parse_datetime_cache': parse_datetime.cache_info()._asdict(),
+            'distinct_values': {summary['field']: summary['distinct_count'] for summary in result['distributions']}})
+        with open(run_profile_path, 'w') as f:
+            json.dump(run_profile, f, indent=2)
+        for phase, seconds in run_profile['phase_seconds'].items():
+            print(f"{phase}: {seconds:.3f} s", file=sys.stderr)
+        print(f"Wrote the run profile to {run_profile_path}.", file=sys.stderr)
+        type_test_counts = None
+    return result
+
+def parse_options(args):
+    """Turn the command-line options that follow the file name into keyword
+    arguments for profile_csv_file."""
+    options = {'maintain_case': False, 'no_integers': False, 'analyze_only': False, 'workers': 1,
+            'sample_size': None, 'confirm': False, 'capacity': None, 'max_key_size': None,
+            'backend': 'python', 'resume': False, 'profile_run': False, 'run_profile_path': None,
+            'page_size': 10000, 'prefetch': 2, 'statistics': False, 'statistics_columns': False,
+            'include': None, 'exclude': None}
+    if 'maintain' in args:
+        options['maintain_case'] = True
+    if 'no_ints' in args:
+        options['no_integers'] = True
+    if 'no_integers' in args:
+        options['no_integers'] = True
+    if 'analyze' in args:
+        options['analyze_only'] = True
+    for arg in args:
+        if re.match(r'workers=\d+$', arg): # Profile the file in parallel with this many processes.
+            options['workers'] = int(arg.split('=')[1])
+        if re.match(r'sample=\d+$', arg): # Draft a dictionary from a sample of (about) twice this many rows.
+            options['sample_size'] = int(arg.split('=')[1])
+        if re.match(r'budget=\d+$', arg): # Keep counts for at most this many distinct values per field.
+            options['capacity'] = int(arg.split('=')[1])
+        if re.match(r'keys=\d+$', arg): # Look for composite primary keys with up to this many fields.
+            options['max_key_size'] = int(arg.split('=')[1])
+        if re.match(r'backend=(python|arrow)$', arg): # Parse and type-test with pyarrow (if it's installed).
+            options['backend'] = arg.split('=')[1]
+        if re.match(r'page_size=\d+$', arg): # Records per datastore_search request (for resource=<ID>)
+            options['page_size'] = int(arg.split('=')[1])
+        if re.match(r'prefetch=\d+$', arg): # Pages to fetch ahead of the one being profiled (for resource=<ID>)
+            options['prefetch'] = int(arg.split('=')[1])
+    if 'keys' in args:
+        options['max_key_size'] = 3
+    if 'resume' in args: # Save the profiles, and only profile rows appended since the last time.
+        options['resume'] = True
+    if 'confirm' in args: # Check the types inferred from a sample against the whole file.
+        options['confirm'] = True
+    for arg in args:
+        # Profile only these columns (or all but these), given as names or
+        # /regular expressions/, separated by commas.
+        for option in ['include', 'exclude']:
+            if arg.startswith(f'{option}='):
+                options[option] = (options[option] or []) + re.findall(r'/.*?/(?=,|$)|[^,]+', arg.split('=', 1)[1])
+    if 'stats' in args: # Report each field's range, mean, quartiles, lengths, or date span.
+        options['statistics'] = True
+    if 'stats_columns' in args: # The same, with the statistics added to the data dictionary
+        options['statistics_columns'] = True
+    if 'profile' in args: # Time the phases of the run and report progress.
+        options['profile_run'] = True
+    for arg in args:
+        if arg.startswith('profile='): # The same, with the timings written to this JSON file
+            options['profile_run'] = True
+            options['run_profile_path'] = arg.split('=', 1)[1]
+    return options
+
 def main():
     if len(sys.argv) < 2:
         print("Please specify the name of the CSV file for which you want to generate")
         print('a data dictionary as a command-line argument. For example:')
         print('      > python lil_lex.py robot_census.csv')
+        print('(The file can also be compressed, like robot_census.csv.gz, or in a zip archive, or - for stdin,')
+        print('or a Parquet, Arrow, or Feather file, like robot_census.parquet.)')
+        print('or give the ID of a CKAN datastore resource to profile it directly:')
+        print('      > python lil_lex.py resource=<resource ID>')
     else:
-        maintain_case = False
-        no_integers = False
-        analyze_only = False
-        if len(sys.argv) > 2:
-            if 'maintain' in sys.argv[2:]:
-                maintain_case = True
-            if 'no_ints' in sys.argv[2:]:
-                no_integers = True
-            if 'no_integers' in sys.argv[2:]:
-                no_integers = True
-            if 'analyze' in sys.argv[2:]:
-                analyze_only = True
-
-        csv_file_path = sys.argv[1]
-        if re.search(r'\.csv$', csv_file_path) is None:
-            print('This whole fragile thing falls apart if the file name does not end in ".csv". Sorry.')
-        else:
-            with open(csv_file_path) as csvfile:
-                reader = csv.DictReader(csvfile)
-                headers = reader.fieldnames
-                print(headers)
-                examples = []
-                types = []
-                none_count = defaultdict(int)
-                parameters = defaultdict(lambda: defaultdict(bool))
-
-                rows = list(reader) # This is necessary since if you just iterate over
-                # the reader once, you can't use it again without doing something.
-                # Remove the _id field added by CKAN, if it's there.
-                if '_id' in headers:
-                    headers.remove('_id')
-                fix_nas = defaultdict(lambda: False)
-                value_distribution = defaultdict(lambda: defaultdict(int))
-
-                for n,field in enumerate(headers):
-                    field_type = None
-                    value_example = None
-                    type_options = ['text', 'int', 'float', 'bool', 'datetime', 'date'] #'json', 'time']
-                    excluded_types = []
-
-                    for row in rows:
-                        #if len(type_options) == 1: # This is an optimization that would speed up
-                        #    break # type detection, BUT it would miss some none values. A correct
-                        # none_count requires checking all values.
-                        type_candidates = [x for x in type_options if x not in excluded_types]
-
-                        if field in row:
-                            value_distribution[field][row[field]] += 1
-                            if row[field] in [None, '', 'NA', 'NULL']:
-                                none_count[n] += 1
-                            if row[field] not in [None, '', 'NA', 'NULL'] and value_example is None:
-                                value_example = row[field]
-                            # Type elimination by brute force
-                            if row[field] is not None:
-                                for option in type_candidates:
-                                    if not test_type(row[field], option):
-                                        excluded_types.append(option)
-
-                                        # [ ] This type-detection scheme fails to detect non-strings when 'NA' values are present.
-                    field_values = [row[field] for row in rows]
-                    type_candidates = [x for x in type_options if x not in excluded_types]
-                    field_type = choose_type(type_candidates, field_values, field)
-
-                    if 'NA' in field_values or 'NULL' in field_values:
-                        fix_nas[field] = True
-                    parameters['unique'][field] = is_unique(field_values)
-                    print("{} {} {} {}".format(field, field_type, type_candidates, "   ALL UNIQUE" if parameters['unique'][field] else "    "))
-                    if field_type is None:
-                        print("No values found for the field {field}.")
-                    if value_example is None:
-                        print("values: No values found for the field {field}.")
-                        parameters['empty'][field] = True # Defaults to False because of the defaultdict.
-                        field_type = 'text' # Override any other field_type and use text when no value was found.
-                    examples.append(value_example)
-                    types.append(field_type)
-
-            print(f"#### VALUE DISTRIBUTION BY FIELD ####")
-            single_value_fields = {}
-            for field, dist in value_distribution.items():
-                if len(dist) == 1:
-                    value = list(dist.keys())[0]
-                    if value not in [None, '', 'NA', 'NULL']:
-                        single_value_fields[field] = value
-                if len(dist) <= 5:
-                    print(f"{field}: {dict(dist)} {'<============================' if len(dist) < 2 else ''}")
-                else:
-                    max_key = max(dist, key=dist.get)
-                    print(f'{field}: {max_key} ({dist[max_key]} rows) + {len(dist) - 1} other values')
-
-            print("\n\nEMPTY FIELDS: {}".format([field for field in parameters['empty'] if parameters['empty'][field]]))
-            print(f"SINGLE-VALUE FIELDS: {single_value_fields}")
-            print("POTENTIAL PRIMARY KEY FIELDS: {}".format([field for field in parameters['unique'] if parameters['unique'][field]]))
-
-            if not analyze_only:
-                list_of_dicts = []
-                for n, field in enumerate(headers):
-                    tuples = [('column', field),
-                            ('type', types[n]),
-                            ('label',''),
-                            ('description',''),
-                            ('example',examples[n])]
-
-                    list_of_dicts.append(OrderedDict(tuples))
-                row1 = list_of_dicts[0]
-                data_dictionary_fields = [tup for tup in row1]
-                data_dictionary_path = re.sub(r"\.csv", "-data-dictionary.csv", csv_file_path)
-                with open(data_dictionary_path, 'w') as csvfile:
-                    writer = csv.DictWriter(csvfile, fieldnames=data_dictionary_fields)
-                    writer.writeheader()
-                    writer.writerows(list_of_dicts)
-
-                ### ETL Wizard functionality: Generate Marshamallow schema for ETL jobs
-                print("\n\n *** *** ** *  *   * ** *      * ** ***** * *   *")
-                schema_type = base_schema_type
-                if no_integers: # Lots of fields are coded as integers, but we want to switch them
-                    # to strings because they are just ID numbers that one should not do math with (like ward IDs).
-                    print("Coercing all integer fields to strings, since so many such fields are not actual counts.")
-                    schema_type = types_no_integers
-
-                dump_tos = []
-                for n, field in enumerate(headers):
-                    arg_string, dump_to = args(field, none_count[n], maintain_case)
-                    s = f"{convert_dots(eliminate_BOM(snake_case(field)))} = fields.{schema_type[types[n]]}({arg_string})"
-                    print(pprint.pformat(s, width=999).strip('"'))
-
-                    if dump_to in dump_tos:
-                        raise ValueError("That list dump_to name conflicts with one that's already in the schema!")
-                    dump_tos.append(dump_to)
-
-                tab = " "*4
-                print(f"\nclass Meta:\n{tab}ordered = True\n")
-                fields_with_nas = [f"'{intermediate_format(field)}'" for field, has_na in fix_nas.items() if has_na]
-                print(f"@pre_load\ndef fix_nas(self, data):\n{tab}fields_with_nas = [{', '.join(fields_with_nas)}]\n{tab}for f in fields_with_nas:\n{tab*2}if data[f] in ['NA', 'NULL']:\n{tab*3}data[f] = None\n")
-
-            # [ ] Infer possible primary-key COMBINATIONS.
-            # [ ] Detect field names that need to be put in load_from arguments.
-                # * Sense whether Marshmallow can convert source field name to snake_case name (exceptions?)
+        profile_csv_file(sys.argv[1], **parse_options(sys.argv[2:]))
 
 if __name__ == '__main__':
     main()
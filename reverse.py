@@ -5,6 +5,7 @@ from collections import OrderedDict, defaultdict
 from pprint import pprint
 
 from lil_lex import detect_case
+from csv_input import is_csv_input, output_csv_path, open_csv
 
 def is_snake_case(s):
     return detect_case(s) == 'snake_case'
@@ -14,24 +15,24 @@ def main():
         print("Please specify the name of the data-dictionary CSV file from which you wish to generate")
         print('a template for a CSV file as a command-line argument. For example:')
         print('      > python reverse.py some_data_dictionary.csv')
+        print('(It can also be compressed, like some_data_dictionary.csv.gz, or in a zip archive, or - for stdin.)')
     else:
         # Extract the column with name "field_name".
         csv_file_path = sys.argv[1]
-        if re.search('\.csv$', csv_file_path) is None:
-            print('This whole thing falls apart if the file name does not end in ".csv". Sorry.')
+        if not is_csv_input(csv_file_path):
+            print('This whole thing falls apart if the file name does not end in ".csv" (or ".gz", ".bz2", ".xz", or ".zip"). Sorry.')
         else:
-            with open(csv_file_path) as csvfile:
+            # Read it all at once, since stdin and compressed files can't be reread.
+            with open_csv(csv_file_path) as csvfile:
                 reader = csv.DictReader(csvfile)
                 headers = reader.fieldnames
+                list_of_dicts = list(reader)
                 print(headers)
 
         if 'field_name' in headers:
-            dictionary_filename = sys.argv[1]
-            list_of_dicts = list(csv.DictReader(open(dictionary_filename)))
-
             fields = [d['field_name'] for d in list_of_dicts]
 
-            headers_path = re.sub("\.csv","-headers.csv",csv_file_path)
+            headers_path = re.sub("\.csv","-headers.csv",output_csv_path(csv_file_path))
             with open(headers_path, 'w') as csvfile:
                 writer = csv.DictWriter(csvfile, fieldnames=fields)
                 writer.writeheader()
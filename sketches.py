@@ -0,0 +1,133 @@
+# Fixed-size summaries of streams of values, for profiling columns that have
+# too many distinct values to count exactly.
+from math import log
+from hashlib import blake2b
+
+class HyperLogLog:
+    """Estimates the number of distinct values added to it, using 2**precision
+    bytes (16 KB by default), with a standard error of about
+    1.04/sqrt(2**precision) (0.8% by default)."""
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value):
+        # Python's hash() varies from process to process, so it can't be used
+        # for sketches that get merged across worker processes.
+        x = int.from_bytes(blake2b(repr(value).encode('utf-8', 'surrogatepass'), digest_size=8).digest(), 'big')
+        j = x >> (64 - self.precision)
+        w = x & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - w.bit_length() + 1
+        if rank > self.registers[j]:
+            self.registers[j] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def relative_error(self):
+        return 1.04/len(self.registers)**0.5
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213/(1 + 1.079/m)
+        e = alpha*m*m/sum(2.0**-r for r in self.registers)
+        zeros = self.registers.count(0)
+        if e <= 2.5*m and zeros > 0:
+            e = m*log(m/zeros) # Linear counting works better for small cardinalities.
+        return round(e)
+
+def add_to_heavy_hitters(counts, value, capacity):
+    """Count value in counts (a dict of value counts) Misra-Gries style, so
+    that counts never has more than capacity entries. Each count is then a
+    lower bound for the true count, low by at most (number of values
+    added)/(capacity + 1), so any value that makes up a large enough share
+    of the stream is sure to be in counts. Returns True if the counts had to
+    be reduced (so that they are no longer exact)."""
+    if value in counts:
+        counts[value] += 1
+        return False
+    if len(counts) < capacity:
+        counts[value] = 1
+        return False
+    # Decrement every count (including the new value's 1) and drop the zeros.
+    for key in list(counts):
+        if counts[key] == 1:
+            del counts[key]
+        else:
+            counts[key] -= 1
+    return True
+
+def trim_heavy_hitters(counts, capacity):
+    """Reduce merged Misra-Gries counts back down to capacity entries.
+    Returns True if anything had to be dropped."""
+    if len(counts) <= capacity:
+        return False
+    cutoff = sorted(counts.values(), reverse=True)[capacity]
+    for key in list(counts):
+        if counts[key] <= cutoff:
+            del counts[key]
+        else:
+            counts[key] -= cutoff
+    return True
+
+class QuantileSketch:
+    """Approximates the quantiles of a stream of numbers (each with a weight)
+    with at most 2*size entries. It's exact until it has seen more than
+    2*size distinct numbers; after that, it repeatedly halves itself by
+    merging neighboring entries, which puts each quantile within about
+    (number of halvings)/size of the right rank. With size None, it's
+    always exact (and holds every distinct number)."""
+    def __init__(self, size=1000):
+        self.size = size
+        self.weights = {}
+        self.exact = True
+
+    def add(self, x, weight=1):
+        weights = self.weights
+        if x in weights:
+            weights[x] += weight
+            return
+        weights[x] = weight
+        if self.size is not None and len(weights) > 2*self.size:
+            self.compress()
+
+    def compress(self):
+        # Replace each pair of neighbors with one of them (alternately the
+        # lower and the higher, so the errors don't pile up in one direction)
+        # carrying the weight of both.
+        items = sorted(self.weights.items())
+        compressed = {}
+        for k in range(0, len(items) - 1, 2):
+            (x, w), (y, v) = items[k], items[k + 1]
+            keep = x if (k//2) % 2 == 0 else y
+            compressed[keep] = compressed.get(keep, 0) + w + v
+        if len(items) % 2 == 1:
+            x, w = items[-1]
+            compressed[x] = compressed.get(x, 0) + w
+        self.weights = compressed
+        self.exact = False
+
+    def merge(self, other):
+        for x, weight in other.weights.items():
+            self.weights[x] = self.weights.get(x, 0) + weight
+        self.exact = self.exact and other.exact
+        while self.size is not None and len(self.weights) > 2*self.size:
+            self.compress()
+
+    def quantiles(self, qs):
+        """Return the (lower) q-quantile of the numbers for each q in qs, or
+        None for each if there are no numbers."""
+        items = sorted(self.weights.items())
+        total = sum(w for _, w in items)
+        results = []
+        for q in qs:
+            if total == 0:
+                results.append(None)
+                continue
+            target, cumulative = q*total, 0
+            for x, w in items:
+                cumulative += w
+                if cumulative >= target:
+                    break
+            results.append(x)
+        return results